@@ -1,41 +1,71 @@
+import concurrent.futures
 import functools
+import json
+import os
 import pathlib
 import re
 import subprocess
 import sys
+import tempfile
+import threading
 
-from utils import CONFIG, log
+from fetch import FetchJob, fetch_all
+from utils import CONFIG, bconds_by_id, log
 
 KOJI_ID_FILENAME = 'koji.id'
+BUILDREQUIRES_FILENAME = 'buildrequires.txt'
 
-reverse_id_lookup = {}
 
-
-def bcond_cache_identifier(component_name, bcond_config, *, branch='', target=''):
+class BcondState:
+    """
+    Per-run state of bconds, keyed by their identifiers:
+     - srpm: a path to the SRPM (from Koji)
+     - koji_task_id: the Koji scratchbuild task ID
+     - buildrequires: a sorted tuple of BuildRequires
+     - updated: whether the repo was new or its HEAD was updated in this run, see refresh_once()
+
+    The Bcond records themselves are immutable, this is where the mutable state lives.
+    It is safe to use from multiple threads of one process, it is not shared with other processes.
+    Other processes only see the results via the files in the repo directories of the bconds
+    (SRPMs, KOJI_ID_FILENAME, BUILDREQUIRES_FILENAME), which are written atomically.
+    The repos are refreshed without any locking (see refresh_once()),
+    so do not run multiple bconds.py processes with the same fedpkg cache_dir at once.
     """
-    Return an unique more or less human-readable string identifier for caching purposes.
-    The form of the identifier is more or less:
-        component_name:without_configuration:with_configuration:replacements_configuration:branch:target
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = {}
+
+    def get(self, bcond, key, default=None):
+        with self._lock:
+            return self._state.get(bcond.id, {}).get(key, default)
+
+    def set(self, bcond, key, value):
+        with self._lock:
+            self._state.setdefault(bcond.id, {})[key] = value
+
+    def has(self, bcond, key):
+        with self._lock:
+            return key in self._state.get(bcond.id, {})
+
 
-    With "defaults" empty. E.g. the gcc package built without tests and docs in rawhide would be:
-        gcc:docs-tests::::
+STATE = BcondState()
 
-    And a complex package without docs and tests but with bootstrap with replaced macro on f35 branch in f35-side-1234:
-        complex:docs-tests:bootstrap:use_supernatular_forces:f35:f35-side-1234
 
-    If multiple options are present, they are sorted for canonical representation
-    and separated with dashes (not possible in macro names).
-    The values of replaced macros are not stored, we assume it won't be needed.
-    From the above notice, it is obvious the form might change in the future.
+def repo_path(bcond):
     """
-    withouts_id = '-'.join(sorted(bcond_config.get('withouts', [])))
-    withs_id = '-'.join(sorted(bcond_config.get('withs', [])))
-    replacements_id = '-'.join(sorted(bcond_config.get('replacements', {})))
-    if branch == CONFIG['distgit']['branch']:
-        branch = ''
-    identifier = f'{component_name}:{withouts_id}:{withs_id}:{replacements_id}:{branch}:{target}'
-    reverse_id_lookup[identifier] = bcond_config
-    return identifier   
+    Returns a path to the dist-git repo of the given Bcond in fedpkg_cache_dir.
+    """
+    return pathlib.Path(CONFIG['cache_dir']['fedpkg']) / bcond.id
+
+
+def write_atomically(path, text):
+    """
+    Writes the text to the given path,
+    other threads and processes either see the old content or the complete new content.
+    """
+    with tempfile.NamedTemporaryFile('w', dir=path.parent, prefix=f'.{path.name}.', delete=False) as fp:
+        fp.write(text)
+    os.replace(fp.name, path)
 
 
 def run(*cmd, **kwargs):
@@ -87,26 +117,68 @@ def srpm_path(directory):
     return candidates[0]
 
 
-def patch_spec(specpath, bcond_config):
-    log(f'   • Patching {specpath.name}')
-
-    run('git', '-C', specpath.parent, 'reset', '--hard')
-
-    spec_text = specpath.read_text()
-
+def patched_spec_text(spec_text, bcond):
+    """
+    Returns the given spec_text with the given Bcond applied.
+    """
     lines = []
-    for without in sorted(bcond_config.get('withouts', ())):
-        if without in bcond_config.get('withs', ()):
-            raise ValueError(f'Cannot have the same with and without: {without}')
+    for without in bcond.withouts:
         lines.append(f'%global _without_{without} 1')
-    for with_ in sorted(bcond_config.get('withs', ())):
+    for with_ in bcond.withs:
         lines.append(f'%global _with_{with_} 1')
-    for macro, value in bcond_config.get('replacements', {}).items():
+    for macro, value in bcond.replacements:
         spec_text = re.sub(fr'^(\s*)%(define|global)(\s+){macro}(\s+)\S.*$',
                            fr'\1%\2\g<3>{macro}\g<4>{value}',
                            spec_text, flags=re.MULTILINE)
     lines.append(spec_text)
-    specpath.write_text('\n'.join(lines))
+    return '\n'.join(lines)
+
+
+def patch_spec(specpath, bcond):
+    log(f'   • Patching {specpath.name}')
+
+    run('git', '-C', specpath.parent, 'reset', '--hard')
+
+    specpath.write_text(patched_spec_text(specpath.read_text(), bcond))
+
+
+def _rpmspec(*args, specpath, arch=None, macros=None):
+    """
+    Runs rpmspec with given args on given specpath for the given arch with given macros defined.
+    By default, uses the Koji architecture and macros from CONFIG['rpmspec'].
+    Sources (e.g. for %include or %load) are looked up next to the specfile.
+    """
+    arch = arch or CONFIG['architectures']['koji']
+    macros = CONFIG['rpmspec']['macros'] if macros is None else macros
+    command = ['rpmspec', *args, f'--target={arch}', '--define', f'_sourcedir {specpath.parent.absolute()}']
+    for macro, value in macros.items():
+        command += ['--define', f'{macro} {value}']
+    return run(*command, specpath).stdout
+
+
+def has_dynamic_buildrequires(specpath, *, arch=None, macros=None):
+    """
+    Returns True if the given specfile has an (active) %generate_buildrequires section.
+    The specfile is parsed, so sections in false conditionals are not considered.
+    Such BuildRequires cannot be queried from the specfile, they need a real build.
+    """
+    parsed = _rpmspec('--parse', specpath=specpath, arch=arch, macros=macros)
+    return re.search(r'^%generate_buildrequires\b', parsed, flags=re.MULTILINE) is not None
+
+
+def spec_buildrequires(specpath, *, arch=None, macros=None):
+    """
+    Returns a collection with BuildRequires of given on-disk specfile,
+    as evaluated by rpm's spec parser for the given arch with given macros defined.
+    rpmlib() requires are filtered out.
+    Dynamic BuildRequires are not included, see has_dynamic_buildrequires().
+
+    The result is a sorted, deduplicated tuple,
+    so it can be hashed as an argument to other cached functions.
+    """
+    raw_requires = _rpmspec('--query', '--buildrequires',
+                            specpath=specpath, arch=arch, macros=macros).splitlines()
+    return tuple(sorted({r for r in raw_requires if not r.startswith('rpmlib(')}))
 
 
 def submit_scratchbuild(repopath, target=''):
@@ -126,8 +198,7 @@ def submit_scratchbuild(repopath, target=''):
         if line.startswith('Created task: '):
             koji_task_id = line.split(' ')[-1]
             log(f'task {koji_task_id}')
-            koji_id_path = repopath / KOJI_ID_FILENAME
-            koji_id_path.write_text(koji_task_id)
+            write_atomically(repopath / KOJI_ID_FILENAME, koji_task_id)
             return koji_task_id
     else:
         raise RuntimeError('Carnot parse fedpkg build output')
@@ -172,74 +243,154 @@ def handle_exisitng_koji_id(repopath, *, was_updated):
                 return koji_task_id
 
 
-def scratchbuild_patched_if_needed(component_name, bcond_config, *, branch='', target=''):
+def clone_or_refresh(component_name, repopath, branch=''):
+    """
+    Clones the given component_name package from Fedora to repopath
+    or refreshes the existing clone.
+    Returns True if the repo is new or HEAD was updated.
+    """
+    if repopath.exists():
+        return refresh_gitrepo(repopath)
+    pathlib.Path(CONFIG['cache_dir']['fedpkg']).mkdir(exist_ok=True)
+    clone_into(component_name, repopath, branch=branch)
+    return True
+
+
+def refresh_once(bcond):
+    """
+    Clones/refreshes the dist-git repo of the given Bcond, see clone_or_refresh(),
+    but only once per run: the local and Koji passes need to know whether it was updated,
+    and a second refresh would not see the commits pulled by the first one.
+    This is only tracked in STATE, i.e. per process.
+    """
+    if not STATE.has(bcond, 'updated'):
+        STATE.set(bcond, 'updated', clone_or_refresh(bcond.component, repo_path(bcond), branch=bcond.branch))
+    return STATE.get(bcond, 'updated')
+
+
+def handle_exisitng_buildrequires(repopath, *, was_updated):
+    buildrequires_path = repopath / BUILDREQUIRES_FILENAME
+    if buildrequires_path.exists():
+        if was_updated:
+            buildrequires_path.unlink()
+            return None
+        log(f'   • Found {BUILDREQUIRES_FILENAME}, will not reparse; remove it to force me.')
+        return tuple(buildrequires_path.read_text().splitlines())
+    return None
+
+
+def local_buildrequires_if_possible(bcond):
+    """
+    This will:
+     1. clone/fetch the package of the given Bcond from Fedora to fedpkg_cache_dir (see refresh_once())
+        in case the repo existed and HEAD was not updated,
+        this ends early if previously extracted BuildRequires are stored in BUILDREQUIRES_FILENAME
+     2. change the specfile to apply the given Bcond
+     3. if the specfile has no dynamic BuildRequires,
+        evaluate the BuildRequires with rpmspec (no Koji round-trip)
+        and write them to BUILDREQUIRES_FILENAME in the repo directory and to STATE
+     4. return True if BuildRequires were added to STATE
+
+    When this returns False, the BuildRequires need to be obtained from a Koji scratchbuild.
+    Unlike scratchbuild_patched_if_needed(), this can safely run in parallel for different bconds.
+    """
+    repopath = repo_path(bcond)
+    news = refresh_once(bcond)
+
+    if (buildrequires := handle_exisitng_buildrequires(repopath, was_updated=news)) is not None:
+        STATE.set(bcond, 'buildrequires', buildrequires)
+        return True
+
+    specpath = repopath / f'{bcond.component}.spec'
+    patch_spec(specpath, bcond)
+    try:
+        if has_dynamic_buildrequires(specpath):
+            log(f'   • {bcond.id} has dynamic BuildRequires, needs Koji.')
+            return False
+        buildrequires = spec_buildrequires(specpath)
+    except subprocess.CalledProcessError as e:
+        log(f'   • Cannot parse {specpath.name} of {bcond.id}, needs Koji:\n{e.stderr}')
+        return False
+
+    write_atomically(repopath / BUILDREQUIRES_FILENAME, ''.join(f'{br}\n' for br in buildrequires))
+    STATE.set(bcond, 'buildrequires', buildrequires)
+    log(f' • Evaluated {len(buildrequires)} BuildRequires of {bcond.id} locally')
+    return True
+
+
+def scratchbuild_patched_if_needed(bcond):
     """
     This will:
-     1. clone/fetch the given component_name package from Fedora to fedpkg_cache_dir
+     1. clone/fetch the package of the given Bcond from Fedora to fedpkg_cache_dir (see refresh_once())
         in case the repo existed and HEAD was not updated, this ends early if:
           - a SRPM exists
           - a previously stored Koji task ID is present and not canceled or failed
-          (both information is added to the provided bcond_config)
-     2. change the specfile to apply the given bcond/macro config
-     3. scratchbuild the package in Koji (in a given target if specified)
+          (both information is added to STATE)
+     2. change the specfile to apply the given Bcond
+     3. scratchbuild the package in Koji (in the target of the Bcond if specified)
      4. cleanup the generated SRPM
-     5. write the Koji ID to KOJI_ID_FILENAME in the repo directory and to bcond_config
+     5. write the Koji ID to KOJI_ID_FILENAME in the repo directory and to STATE
      6. return True if something was submitted to Koji
     """
-    repopath = pathlib.Path(CONFIG['cache_dir']['fedpkg']) / bcond_config['id']
-    if repopath.exists():
-        news = refresh_gitrepo(repopath)
-    else:
-        pathlib.Path(CONFIG['cache_dir']['fedpkg']).mkdir(exist_ok=True)
-        clone_into(component_name, repopath, branch=branch)
-        news = True
+    repopath = repo_path(bcond)
+    news = refresh_once(bcond)
 
     if srpm := handle_exisitng_srpm(repopath, was_updated=news):
-        bcond_config['srpm'] = srpm
+        STATE.set(bcond, 'srpm', srpm)
         return False
 
     if koji_id := handle_exisitng_koji_id(repopath, was_updated=news):
-        bcond_config['koji_task_id'] = koji_id
+        STATE.set(bcond, 'koji_task_id', koji_id)
         return False
 
-    specpath = repopath / f'{component_name}.spec'
-    patch_spec(specpath, bcond_config)
-    if 'bootstrap' in bcond_config.get('withs', ()):
+    specpath = repopath / f'{bcond.component}.spec'
+    patch_spec(specpath, bcond)
+    if 'bootstrap' in bcond.withs:
         # bump the release not to create an older EVR with ~bootstrap
         # this is useful if we build the testing SRPMs in copr
         run('rpmdev-bumpspec', '--rightmost', specpath)
 
-    bcond_config['koji_task_id'] = submit_scratchbuild(repopath, target=target)
+    STATE.set(bcond, 'koji_task_id', submit_scratchbuild(repopath, target=bcond.target))
     return True
 
 
-def download_srpm_if_possible(component_name, bcond_config):
+def koji_call(method, *args):
+    """
+    Calls the given Koji API method with given args (strings, parsed by koji, e.g. 'stat=True').
+    Returns the parsed JSON result.
+    """
+    return json.loads(run('koji', 'call', '--json-output', method, *args).stdout)
+
+
+def srpm_fetch_job_if_possible(bcond):
     """
     This will:
-     1. inspect the bcond_config for srpm path and a koji build id
-     2. if srpm exists or koji build doesn't, do nothing
-     3. if koji build is closed, download the srpm and store the path in bcond_config
-     4. return True if something was downloaded
-    """
-    if ('srpm' in bcond_config or
-            'koji_task_id' not in bcond_config or
-            koji_status(bcond_config['koji_task_id']) != 'closed'):
-        return False
-    log(' • Downloading SRPM from Koji...', end=' ')
-    repopath = pathlib.Path(CONFIG['cache_dir']['fedpkg']) / bcond_config['id']
-    command = ('koji', 'download-task', bcond_config['koji_task_id'], '--arch=src', '--noprogress')
-    koji_output = run(*command, cwd=repopath).stdout.splitlines()
-    if (l := len(koji_output)) != 1:
-        raise RuntimeError(f'Cannot parse koji download-task ouptut, expected 1 line, got {l}')
-    srpm_filename = koji_output[0].split(' ')[-1]
-    if not srpm_filename.endswith('.src.rpm'):
-        raise RuntimeError('Cannot parse koji download-task ouptut, expected a *.src.rpm filename, got {srpm_filename}')
-    srpm = repopath / srpm_filename
-    if not srpm.exists():
-        raise RuntimeError('Downloaded SRPM does not exist: {srpm}')
-    bcond_config['srpm'] = srpm
-    log(srpm_filename)
-    return True
+     1. inspect STATE for srpm path and a koji build id of the given Bcond
+     2. if srpm exists or koji build doesn't or is not closed, return None
+     3. find the SRPM in the outputs of the Koji task (or its children)
+     4. return a FetchJob to download the SRPM to the repo directory
+    """
+    koji_task_id = STATE.get(bcond, 'koji_task_id')
+    if STATE.has(bcond, 'srpm') or koji_task_id is None or koji_status(koji_task_id) != 'closed':
+        return None
+    repopath = repo_path(bcond)
+    task_ids = [int(koji_task_id)] + [child['id'] for child in koji_call('getTaskChildren', koji_task_id)]
+    for task_id in task_ids:
+        for filename, stat in koji_call('listTaskOutput', str(task_id), 'stat=True').items():
+            if filename.endswith('.src.rpm'):
+                url = f'{CONFIG["koji"]["topurl"]}/work/tasks/{task_id % 10000}/{task_id}/{filename}'
+                return FetchJob(url, repopath / filename, size=int(stat['st_size']))
+    raise RuntimeError(f'Cannot find a SRPM in Koji task {koji_task_id} or its children')
+
+
+def verify_rpm_digests(rpm):
+    """
+    Verifies the digests (not the signatures) of the given on-disk RPM package.
+    Raises ValueError if they don't match (e.g. the download is corrupted).
+    """
+    result = run('rpm', '--checksig', '--nosignature', rpm, check=False)
+    if result.returncode:
+        raise ValueError(f'Bad digests: {result.stdout.strip()} {result.stderr.strip()}')
 
 
 def rpm_requires(rpm):
@@ -255,57 +406,74 @@ def rpm_requires(rpm):
     return tuple(sorted({r for r in raw_requires if not r.startswith('rpmlib(')}))
 
 
-def extract_buildrequires_if_possible(component_name, bcond_config):
+def extract_buildrequires_if_possible(bcond):
     """
     This will:
-     1. inspect the bcond_config for srpm path
-     2. if srpm does not exist, do nothing
-     3. add buildrequires of the found srpm to the bcond_config
-     4. return True if srpm was found
-    """
-    if 'srpm' not in bcond_config:
-        if srpm := srpm_path(pathlib.Path(CONFIG['cache_dir']['fedpkg']) / bcond_config['id']):
-            bcond_config['srpm'] = srpm
-        else:
-            return False
-    bcond_config['buildrequires'] = rpm_requires(bcond_config['srpm'])
-    log(f' • Extracted {len(bcond_config["buildrequires"])} BuildRequires from {bcond_config["srpm"].name}')
-    return True
-
-
-def each_bcond_name_config():
-    for component_name, bcond_configs in CONFIG['bconds'].items():
-        for bcond_config in bcond_configs:
-            bcond_config['id'] = bcond_cache_identifier(component_name, bcond_config)
-            yield component_name, bcond_config
-
-
-def build_reverse_id_lookup():
-    for _ in each_bcond_name_config():
-        pass
+     1. inspect STATE for BuildRequires of the given Bcond, return them if present
+     2. if BuildRequires were evaluated locally, use them
+     3. inspect STATE (or the repo directory) for srpm path
+     4. if srpm does not exist, return None
+     5. add buildrequires of the found srpm to STATE and return them
+    """
+    if (buildrequires := STATE.get(bcond, 'buildrequires')) is not None:
+        return buildrequires
+    repopath = repo_path(bcond)
+    if (buildrequires_path := repopath / BUILDREQUIRES_FILENAME).exists():
+        buildrequires = tuple(buildrequires_path.read_text().splitlines())
+        log(f' • Loaded {len(buildrequires)} BuildRequires from {BUILDREQUIRES_FILENAME}')
+    else:
+        if (srpm := STATE.get(bcond, 'srpm')) is None:
+            if srpm := srpm_path(repopath):
+                STATE.set(bcond, 'srpm', srpm)
+            else:
+                return None
+        buildrequires = rpm_requires(srpm)
+        log(f' • Extracted {len(buildrequires)} BuildRequires from {srpm.name}')
+    STATE.set(bcond, 'buildrequires', buildrequires)
+    return buildrequires
 
 
 if __name__ == '__main__':
-    # build everything
+    # evaluate everything we can locally, the specs are independent, so in parallel
+    bconds = list(bconds_by_id().values())
+    with concurrent.futures.ThreadPoolExecutor(max_workers=CONFIG['rpmspec']['workers']) as executor:
+        extracted_count = sum(executor.map(local_buildrequires_if_possible, bconds))
+    log(f'Evaluated BuildRequires of {extracted_count} specs locally.')
+
+    # build everything else (i.e. with dynamic BuildRequires)
     something_was_submitted = False
-    for component_name, bcond_config in each_bcond_name_config():
-        something_was_submitted |= scratchbuild_patched_if_needed(component_name, bcond_config)
+    for bcond in bconds:
+        if not STATE.has(bcond, 'buildrequires'):
+            something_was_submitted |= scratchbuild_patched_if_needed(bcond)
 
     # download everything until there's nothing downloaded
     # the idea is that while downloading, other tasks could finish
     something_was_downloaded = True  # bogus initial value to be able to start
-    extracted_count = 0
     while something_was_downloaded:
-        something_was_downloaded = False
+        fetch_jobs = {}
+        for bcond in bconds:
+            if STATE.has(bcond, 'buildrequires'):
+                continue
+            try:
+                if job := srpm_fetch_job_if_possible(bcond):
+                    fetch_jobs[job] = bcond
+            except RuntimeError as e:
+                # e.g. a task without a SRPM, the other bconds can still be fetched
+                log(f' • Skipping {bcond.id}: {e}')
+        if fetch_jobs:
+            log(f' • Downloading {len(fetch_jobs)} SRPMs from Koji...')
+        fetched = fetch_all(fetch_jobs, workers=CONFIG['fetch']['workers'], retries=CONFIG['fetch']['retries'],
+                            verify=verify_rpm_digests)
+        for job, srpm in fetched.items():
+            STATE.set(fetch_jobs[job], 'srpm', srpm)
+        something_was_downloaded = bool(fetched)
         # while we were downloading, we could have finished Koji builds
-        for pkg, bcond_configs in CONFIG['bconds'].items():
-            for bcond_config in bcond_configs:
-                if 'buildrequires' not in bcond_config:
-                    something_was_downloaded |= download_srpm_if_possible(component_name, bcond_config)
-                    if extract_buildrequires_if_possible(component_name, bcond_config):
-                        extracted_count += 1
+        for bcond in bconds:
+            if not STATE.has(bcond, 'buildrequires'):
+                if extract_buildrequires_if_possible(bcond) is not None:
+                    extracted_count += 1
         koji_status.cache_clear()
 
-    log(f'Extracted BuildRequires from {extracted_count} SRPMs.')
-    if not_extracted_count := sum(len(bcond_configs) for bcond_configs in CONFIG['bconds'].values()) - extracted_count:
+    log(f'Extracted BuildRequires from {extracted_count} specs/SRPMs.')
+    if not_extracted_count := len(bconds) - extracted_count:
         sys.exit(f'{not_extracted_count} SRPMs remain to be built/downloaded/extracted, run this again in a while.')
@@ -0,0 +1,47 @@
+import sys
+import time
+
+from bconds import extract_buildrequires_if_possible
+from resolve_buildroot import buildrequires_of, resolve_requires, resolve_requires_from
+from utils import bconds_by_id, log, stringify
+
+
+def bench(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    # Compares resolving the buildroots of all bcond variants (the bootstrap phase)
+    # from scratch and from the buildroots of their components, verifies the results match.
+    # Optionally, limit this to the given components.
+    full_total = delta_total = 0.0
+    count = mismatches = 0
+    for bcond in bconds_by_id().values():
+        if len(sys.argv) > 1 and bcond.component not in sys.argv[1:]:
+            continue
+        if (bcond_buildrequires := extract_buildrequires_if_possible(bcond)) is None:
+            continue
+        base_requires = buildrequires_of(bcond.component)
+        bcond_requires = tuple(sorted(bcond_buildrequires))
+        try:
+            resolve_requires(base_requires)  # the base is resolved in jobs.py anyway
+            # the uncached function, the cache might already have the result
+            full, full_time = bench(resolve_requires.__wrapped__, bcond_requires, True)
+        except ValueError as e:
+            log(f'\n  ✗ {e}')
+            continue
+        delta, delta_time = bench(resolve_requires_from, base_requires, bcond_requires)
+        if set(full) != set(delta):
+            mismatches += 1
+            log(f'✗ {bcond.id}: {stringify(set(full) ^ set(delta))}')
+        count += 1
+        full_total += full_time
+        delta_total += delta_time
+        print(f'{bcond.id:<60} full {full_time:7.3f} s  delta {delta_time:7.3f} s')
+
+    print(f'\n{count} bcond variants: full {full_total:.3f} s, delta {delta_total:.3f} s, '
+          f'{mismatches} mismatches')
+    if mismatches:
+        sys.exit(1)
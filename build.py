@@ -5,10 +5,7 @@ import sys
 # XXX move to a common module?
 from bconds import clone_into, refresh_gitrepo, patch_spec, run
 
-# the following bcond things actually do stay there
-from bconds import reverse_id_lookup, build_reverse_id_lookup
-
-from utils import CONFIG
+from utils import CONFIG, bconds_by_id
 
 
 PATCHDIR = pathlib.Path('patches_dir')
@@ -22,8 +19,7 @@ if __name__ == '__main__':
 
         bootstrap = None
         if ':' in component_name:
-            build_reverse_id_lookup()
-            bootstrap = reverse_id_lookup[component_name]
+            bootstrap = bconds_by_id()[component_name]
             component_name, *_ = component_name.partition(':')
 
         # XXX make a reusable function with just refresh_gitrepo/clone_into
@@ -0,0 +1,106 @@
+import argparse
+import json
+import pathlib
+
+from utils import CONFIG, campaigns, log
+
+
+def index_path(campaign_name):
+    """
+    Returns a path to the stored index of the given campaign.
+    """
+    return pathlib.Path(CONFIG['cache_dir']['index']) / f'{campaign_name}.json'
+
+
+def build_index(buildroots):
+    """
+    Given a dict of evaluated buildroots (see jobs.evaluate_campaign()),
+    returns an index in a dict:
+     - buildroots: the given dict
+     - dependents: a dict of to-rebuild components to sorted lists of keys of the buildroots
+       (component names for regular buildroots, bcond identifiers for bcond variants)
+       that contain their binary packages
+    """
+    dependents = {}
+    for key, buildroot in buildroots.items():
+        for required_component in buildroot['requires']:
+            dependents.setdefault(required_component, []).append(key)
+    return {
+        'buildroots': buildroots,
+        'dependents': {component: sorted(keys) for component, keys in sorted(dependents.items())},
+    }
+
+
+def save_index(index, campaign_name):
+    path = index_path(campaign_name)
+    path.parent.mkdir(exist_ok=True)
+    path.write_text(json.dumps(index, indent=1, sort_keys=True))
+    log(f'• Saved index of {len(index["buildroots"])} buildroots to {path}')
+
+
+def load_index(campaign_name):
+    """
+    Loads the index saved by jobs.py for the given campaign.
+    Raises FileNotFoundError when jobs.py was not run yet.
+    """
+    return json.loads(index_path(campaign_name).read_text())
+
+
+def dependents_of(index, component):
+    """
+    Returns a sorted list of components and bcond identifiers
+    whose buildroots contain binary packages of the given component.
+    """
+    return index['dependents'].get(component, [])
+
+
+def newly_ready(index, components_done):
+    """
+    Given a collection of components that are considered done (e.g. just rebuilt),
+    returns a sorted list of components and bcond identifiers that were blocked,
+    but would be ready to rebuild if those components were done.
+
+    Components already rebuilt (or given as done) are not reported, nor are their bcond variants.
+    A bcond variant is only reported if the regular buildroot of its component would remain blocked.
+    """
+    components_done = set(components_done)
+    ready_components = set()
+    ready_variants = set()
+    candidates = {key for component in components_done for key in dependents_of(index, component)}
+    for key in candidates:
+        buildroot = index['buildroots'][key]
+        if buildroot['done'] or buildroot['component'] in components_done or not buildroot['blocking']:
+            continue
+        if not set(buildroot['blocking']) <= components_done:
+            continue
+        if buildroot['variant']:
+            ready_variants.add((buildroot['component'], key))
+        else:
+            ready_components.add(key)
+    ready_variants = {key for component, key in ready_variants if component not in ready_components}
+    return sorted(ready_components | ready_variants)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Query the index of dependent buildroots saved by jobs.py.')
+    parser.add_argument('--campaign', default=None, metavar='NAME',
+                        help='query the index of this campaign (default: the only one)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('of', help='list dependents of a component').add_argument('component')
+    subparsers.add_parser('ready', help='list what becomes ready if the components are done'
+                          ).add_argument('components', nargs='+')
+    args = parser.parse_args()
+
+    if args.campaign is None:
+        if len(all_campaigns := campaigns()) > 1:
+            parser.error(f'Select one of the campaigns: {", ".join(all_campaigns)}')
+        args.campaign, = all_campaigns
+
+    index = load_index(args.campaign)
+    if args.command == 'of':
+        results = dependents_of(index, args.component)
+    else:
+        results = newly_ready(index, args.components)
+    for identifier in results:
+        print(identifier)
@@ -0,0 +1,160 @@
+import argparse
+import concurrent.futures
+import json
+import pathlib
+import re
+import subprocess
+import tempfile
+
+from bconds import clone_or_refresh, has_dynamic_buildrequires, patched_spec_text, spec_buildrequires
+from utils import CONFIG, Bcond, log
+
+TOML_BARE_KEY_RE = re.compile(r'^[A-Za-z0-9_-]+$')
+BCOND_RE = re.compile(r'^\s*%(?:bcond_with|bcond_without|bcond)\s+(\w+)', flags=re.MULTILINE)
+
+
+def declared_bconds(spec_text):
+    """
+    Returns a sorted tuple of names of bconds declared in the given spec_text
+    (via %bcond_with, %bcond_without or %bcond).
+    """
+    return tuple(sorted(set(BCOND_RE.findall(spec_text))))
+
+
+def candidate_bconds(component_name, bcond_names):
+    """
+    Yields Bcond records of the given component that flip a single bcond of the given names.
+    The default values are not known here, so both the with and the without are yielded
+    (one of them will not change anything).
+    """
+    for name in bcond_names:
+        yield Bcond(component_name, withs=(name,))
+        yield Bcond(component_name, withouts=(name,))
+
+
+def _patched_buildrequires(specpath, spec_text, bcond):
+    # the patched spec is next to the original, so %include and %load still work
+    with tempfile.NamedTemporaryFile('w', dir=specpath.parent, suffix='.spec') as patched:
+        patched.write(patched_spec_text(spec_text, bcond))
+        patched.flush()
+        return spec_buildrequires(pathlib.Path(patched.name))
+
+
+def buildrequires_changes(component_name):
+    """
+    Clones/refreshes the dist-git repo of the given component in fedpkg_cache_dir,
+    and for each candidate Bcond flipping one declared bcond,
+    evaluates the BuildRequires with rpmspec and compares them to the unpatched ones.
+
+    Returns a list of (Bcond, dropped BuildRequires, added BuildRequires) tuples,
+    only for candidates that change the BuildRequires.
+    If the repo cannot be cloned/refreshed or the unpatched spec cannot be parsed, the list is empty.
+    Specfiles with dynamic BuildRequires are evaluated as well, but only their static part is compared.
+    """
+    repopath = pathlib.Path(CONFIG['cache_dir']['fedpkg']) / component_name
+    try:
+        clone_or_refresh(component_name, repopath)
+        specpath = repopath / f'{component_name}.spec'
+        spec_text = specpath.read_text()
+        if has_dynamic_buildrequires(specpath):
+            log(f' • {component_name} has dynamic BuildRequires, only the static ones are considered')
+        base = set(spec_buildrequires(specpath))
+    except subprocess.CalledProcessError as e:
+        log(f' • Cannot get or parse the spec of {component_name}, skipping:\n{e.stderr}')
+        return []
+    changes = []
+    for bcond in candidate_bconds(component_name, declared_bconds(spec_text)):
+        try:
+            variant = set(_patched_buildrequires(specpath, spec_text, bcond))
+        except subprocess.CalledProcessError as e:
+            log(f' • Cannot parse {bcond.id}:\n{e.stderr}')
+            continue
+        if variant != base:
+            changes.append((bcond, tuple(sorted(base - variant)), tuple(sorted(variant - base))))
+    log(f' • {component_name}: {len(changes)} bcond candidates change the BuildRequires')
+    return changes
+
+
+def blocking_buildrequires(buildrequires, component_name, cluster):
+    """
+    Given a collection of BuildRequires of the given component,
+    returns a sorted tuple of those that pull in packages of other components in the cluster.
+    Packages of the default buildroot are installed regardless of the BuildRequires, so they are not considered.
+    """
+    from resolve_buildroot import resolve_requires
+
+    default_buildroot = set(resolve_requires(()))
+    blocking = set()
+    for br in buildrequires:
+        try:
+            installs = set(resolve_requires((br,))) - default_buildroot
+        except ValueError:
+            continue
+        if any(p.source_name in cluster and p.source_name != component_name for p in installs):
+            blocking.add(br)
+    return tuple(sorted(blocking))
+
+
+def rank_candidates(changes_by_component, cluster):
+    """
+    Given a dict of components to their buildrequires_changes(),
+    returns a list of (score, Bcond, dropped blocking BuildRequires) tuples,
+    sorted by the score: the number of dropped blocking BuildRequires minus the added ones.
+    Only candidates with a positive score are returned.
+
+    For components with more than one such candidate,
+    a combination of all of them is ranked as well
+    (scored by the union of their dropped blocking BuildRequires).
+    """
+    ranked = []
+    for component_name, changes in changes_by_component.items():
+        component_ranked = []
+        for bcond, dropped, added in changes:
+            dropped_blocking = blocking_buildrequires(dropped, component_name, cluster)
+            score = len(dropped_blocking) - len(blocking_buildrequires(added, component_name, cluster))
+            if score > 0:
+                component_ranked.append((score, bcond, dropped_blocking))
+        if len(component_ranked) > 1:
+            try:
+                combined = Bcond(component_name,
+                                 withs=[name for _, bcond, _ in component_ranked for name in bcond.withs],
+                                 withouts=[name for _, bcond, _ in component_ranked for name in bcond.withouts])
+            except ValueError:
+                # flipping the same bcond both ways only happens with non-literal defaults
+                combined = None
+            if combined:
+                dropped_blocking = tuple(sorted({br for *_, brs in component_ranked for br in brs}))
+                component_ranked.append((len(dropped_blocking), combined, dropped_blocking))
+        ranked += component_ranked
+    return sorted(ranked, key=lambda item: (-item[0], item[1].id))
+
+
+def to_toml(score, bcond, dropped_blocking):
+    """
+    Returns a ready-to-paste [[bconds.X]] TOML snippet for the given ranked candidate.
+    """
+    # component names may contain characters not allowed in bare keys (e.g. . or +)
+    key = bcond.component if TOML_BARE_KEY_RE.match(bcond.component) else json.dumps(bcond.component)
+    lines = [f'# drops {score} blocking BuildRequires: {", ".join(dropped_blocking)}',
+             f'[[bconds.{key}]]']
+    for key in 'withs', 'withouts':
+        if names := getattr(bcond, key):
+            lines.append(f'{key} = {json.dumps(list(names))}')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Find bconds that break dependency loops between the given components.')
+    parser.add_argument('components', nargs='+',
+                        help='components of a loop cluster (e.g. from the jobs.py loop report)')
+    args = parser.parse_args()
+    cluster = set(args.components)
+
+    # evaluating the specs only needs rpmspec, so it runs in parallel
+    with concurrent.futures.ThreadPoolExecutor(max_workers=CONFIG['rpmspec']['workers']) as executor:
+        changes_by_component = dict(zip(args.components, executor.map(buildrequires_changes, args.components)))
+
+    # hawkey is not thread-safe, so the resolution runs here
+    for candidate in rank_candidates(changes_by_component, cluster):
+        print(to_toml(*candidate), end='\n\n')
@@ -0,0 +1,144 @@
+import collections
+import concurrent.futures
+import hashlib
+import http.client
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from utils import log
+
+CHUNK_SIZE = 1024 * 1024
+
+FetchJob = collections.namedtuple('FetchJob', 'url destination size sha256', defaults=(None, None))
+FetchJob.__doc__ = """
+A file to fetch from url to destination (a pathlib.Path).
+The optional size (in bytes) and sha256 (hex digest) are verified after the download.
+"""
+
+
+class FetchStats:
+    """
+    Thread-safe counters of downloaded bytes and files, for reporting bandwidth and throughput.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self.bytes = 0
+        self.files = 0
+        self.failures = 0
+
+    def add(self, *, downloaded=0, files=0, failures=0):
+        with self._lock:
+            self.bytes += downloaded
+            self.files += files
+            self.failures += failures
+
+    def summary(self):
+        elapsed = time.perf_counter() - self._start
+        return (f'{self.files} files ({self.bytes / 2**20:.1f} MiB) in {elapsed:.1f} s, '
+                f'{self.bytes / 2**20 / elapsed:.2f} MiB/s, {self.files / elapsed:.2f} files/s, '
+                f'{self.failures} failed')
+
+
+def _partial_path(destination):
+    # does not end with .src.rpm, so bconds.srpm_path() will never pick it up
+    return destination.with_name(destination.name + '.part')
+
+
+def _verify(path, job, verify):
+    if job.size is not None and (size := path.stat().st_size) != job.size:
+        raise ValueError(f'expected {job.size} bytes, got {size}')
+    if job.sha256 is not None:
+        sha256 = hashlib.sha256()
+        with path.open('rb') as fp:
+            while chunk := fp.read(CHUNK_SIZE):
+                sha256.update(chunk)
+        if sha256.hexdigest() != job.sha256:
+            raise ValueError(f'expected sha256 {job.sha256}, got {sha256.hexdigest()}')
+    if verify is not None:
+        verify(path)
+
+
+def _download(job, partial, stats, timeout):
+    """
+    Downloads job.url to partial, resuming from what is already there.
+    """
+    offset = partial.stat().st_size if partial.exists() else 0
+    headers = {'Range': f'bytes={offset}-'} if offset else {}
+    try:
+        response = urllib.request.urlopen(urllib.request.Request(job.url, headers=headers), timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 416 and offset:
+            return  # the partial file is already complete
+        raise
+    with response:
+        if offset and response.status != 206:
+            offset = 0  # the server does not support ranges, start over
+        elif offset and not response.headers.get('Content-Range', '').startswith(f'bytes {offset}-'):
+            partial.unlink()  # the next attempt starts over
+            raise http.client.HTTPException(f'unexpected Content-Range {response.headers.get("Content-Range")}')
+        downloaded = 0
+        with partial.open('ab' if offset else 'wb') as fp:
+            while chunk := response.read(CHUNK_SIZE):
+                fp.write(chunk)
+                downloaded += len(chunk)
+                stats.add(downloaded=len(chunk))
+        # a connection closed early is not an error for read(), but the partial file is kept for resuming
+        if (expected := response.headers.get('Content-Length')) and downloaded != int(expected):
+            raise http.client.IncompleteRead(b'', int(expected) - downloaded)
+
+
+def fetch(job, *, retries=3, timeout=60, verify=None, stats=None):
+    """
+    Downloads the given FetchJob, returns the destination path.
+
+    The data is downloaded to a partial file next to the destination,
+    when the download is interrupted, the next attempt resumes it (if the server supports ranges).
+    The partial file is verified (see FetchJob, and verify, an optional callable that raises on bad files)
+    and only then it is atomically renamed to the destination.
+    A partial file that fails the verification is removed and downloaded again.
+
+    Raises RuntimeError if the file cannot be downloaded and verified in the given number of attempts.
+    """
+    stats = stats or FetchStats()
+    partial = _partial_path(job.destination)
+    for attempt in range(1, retries + 1):
+        try:
+            _download(job, partial, stats, timeout)
+        except (urllib.error.URLError, http.client.HTTPException, OSError) as e:
+            log(f'   • Downloading {job.url} failed (attempt {attempt}/{retries}): {e}')
+            continue
+        try:
+            _verify(partial, job, verify)
+        except (ValueError, RuntimeError) as e:
+            log(f'   • Verification of {job.url} failed (attempt {attempt}/{retries}): {e}')
+            partial.unlink()
+            continue
+        os.replace(partial, job.destination)
+        stats.add(files=1)
+        return job.destination
+    stats.add(failures=1)
+    raise RuntimeError(f'Cannot fetch {job.url} in {retries} attempts')
+
+
+def fetch_all(jobs, *, workers=4, retries=3, timeout=60, verify=None):
+    """
+    Downloads all given FetchJobs, at most the given number of workers at a time, see fetch().
+    Returns a dict of the jobs to their destination paths, failed jobs are omitted.
+    The bandwidth and throughput are logged when done.
+    """
+    stats = FetchStats()
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch, job, retries=retries, timeout=timeout, verify=verify, stats=stats): job
+                   for job in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except RuntimeError as e:
+                log(f' • {e}')
+    log(f' • Fetched {stats.summary()}')
+    return results
@@ -1,9 +1,12 @@
+import argparse
 import collections
 import functools
-import sys
+import pathlib
 
-from sacks import MULTILIB, rawhide_sack, target_sack
-from utils import CONFIG, log
+from dependents import build_index, save_index
+from sacks import MULTILIB, rawhide_sack, target_packages
+from shards import dump_results, in_shard, load_results, merge_results, most_common, parse_shard
+from utils import CONFIG, campaigns, log
 
 
 class ReverseLookupDict(collections.defaultdict):
@@ -36,8 +39,8 @@ class ReverseLookupDict(collections.defaultdict):
         return {value for lst in self.values() for value in lst}
 
 
-@functools.lru_cache(maxsize=1)
-def packages_to_rebuild(old_deps, *, excluded_components=()):
+@functools.cache
+def packages_to_rebuild(old_deps, *, excluded_components=(), extra_components=()):
     """
     Given a hashable collection of string-dependencies that are "old",
     queries rawhide for all binary packages that require those
@@ -47,6 +50,12 @@ def packages_to_rebuild(old_deps, *, excluded_components=()):
 
     Excluded_components is an optional hashable collection of component names
     to exclude from the results.
+    Extra_components is an optional hashable collection of component names
+    to include in the results (with no binary packages).
+
+    The results are cached for each set of arguments,
+    so multiple campaigns can be evaluated in one run.
+    The returned dict is shared, do not modify it.
 
     If rawhide does not contain our newly rebuilt packages (which is expected here),
     the dict will also contain packages that already successfully rebuilt
@@ -64,14 +73,16 @@ def packages_to_rebuild(old_deps, *, excluded_components=()):
             components[result.source_name].append(result)
         else:
             anticount += 1
+    for component in extra_components:
+        components.setdefault(component, [])
     # no longer create lists on access to avoid mistakes:
     components.default_factory = None
     log(f'found {len(components)} components ({len(results)-anticount} binary packages).')
     return components
 
 
-@functools.lru_cache(maxsize=1)
-def packages_built(new_deps, *, excluded_components=()):
+@functools.cache
+def packages_built(new_deps, *, excluded_components=(), repo_key='target'):
     """
     Given a hashable collection of string-dependencies that are "new",
     queries target for all binary packages that require those
@@ -81,10 +92,14 @@ def packages_built(new_deps, *, excluded_components=()):
 
     Excluded_components is an optional hashable collection of component names
     to exclude from the results.
+    Repo_key selects the target repos from CONFIG['repos'].
+
+    The results are cached for each set of arguments,
+    so multiple campaigns can be evaluated in one run.
+    The returned dict is shared, do not modify it.
     """
-    sack = target_sack()
     log('• Querying all successfully rebuilt packages...', end=' ')
-    results = sack.query().filter(requires=new_deps, arch__neq='src', latest=1)
+    results = target_packages(repo_key).filter(requires=new_deps, arch__neq='src', latest=1)
     if CONFIG['architectures']['repoquery'] in MULTILIB:
         results = results.filter(arch__neq=MULTILIB[CONFIG['architectures']['repoquery']])
     components = ReverseLookupDict()
@@ -100,10 +115,37 @@ def packages_built(new_deps, *, excluded_components=()):
     return components
 
 
-def are_all_done(*, packages_to_check, all_components, components_done, blocker_counter, loop_detector):
+def new_blocker_counter():
+    return {
+        'general': collections.Counter(),
+        'single': collections.Counter(),
+        'combinations': collections.Counter(),
+    }
+
+
+def packages_not_done(all_components, components_done):
     """
-    Given a collection of (binary) packages_to_check, and dicts of all_components and components_done,
+    Given dicts of all_components and components_done,
+    returns a frozenset of names of all (binary) packages that are not considered "done", see are_all_done().
+    """
+    not_done = set()
+    for component, packages in all_components.items():
+        done_names = {p.name for p in components_done.get(component, ())}
+        not_done |= {p.name for p in packages
+                     # XXX cython was renamed after the rebuild
+                     if p.name not in done_names and p.name != 'python3-Cython'}
+    return frozenset(not_done)
+
+
+def are_all_done(*, component, packages_to_check, all_components, components_done, blocker_counter, loop_detector,
+                 buildroots, variant=None):
+    """
+    Given a collection of (binary) packages_to_check of a buildroot of the component
+    (or of its bcond variant identifier), and dicts of all_components and components_done,
     returns True if ALL packages_to_check are considered "done" (i.e. installable).
+
+    The relevant and blocking components of the buildroot are recorded in the buildroots dict,
+    keyed by the variant identifier (or the component name), see dependents.build_index().
     """
     relevant_components = ReverseLookupDict()
     for pkg in packages_to_check:
@@ -143,10 +185,17 @@ def are_all_done(*, packages_to_check, all_components, components_done, blocker_
             blocker_counter['general'][relevant_component] += 1
             blocking_components.add(relevant_component)
     if len(blocking_components) == 1:
-        blocker_counter['single'][blocking_components.pop()] += 1
+        blocker_counter['single'][next(iter(blocking_components))] += 1
     elif 1 < len(blocking_components) < 10:  # this is an arbitrarily chosen number to avoid cruft
         blocker_counter['combinations'][tuple(sorted(blocking_components))] += 1
     loop_detector[component] = sorted(blocking_components)
+    buildroots[variant or component] = {
+        'component': component,
+        'variant': variant,
+        'requires': sorted(relevant_components),
+        'blocking': loop_detector[component],
+        'done': component in components_done,
+    }
     return all_available
 
 
@@ -155,10 +204,10 @@ def _sort_loop(loop):
     return tuple(loop[index:] + loop[:index+1])
 
 
-def _detect_loop(loop_detector, probed_component, depchain, loops, seen):
+def _detect_loop(loop_detector, bconds, probed_component, depchain, loops, seen):
     for component in loop_detector[probed_component]:
         seen.add(component)
-        if component in CONFIG['bconds']:
+        if component in bconds:
             # we assume bconds are manually crafted not to have loops
             continue
         if loop_detector.get(component, []) == []:
@@ -166,93 +215,233 @@ def _detect_loop(loop_detector, probed_component, depchain, loops, seen):
         if component in depchain:
             loops.add(_sort_loop(depchain[depchain.index(component):]))
             continue
-        _detect_loop(loop_detector, component, depchain + [component], loops, seen)
+        _detect_loop(loop_detector, bconds, component, depchain + [component], loops, seen)
 
-def report_blocking_components(loop_detector):
+def report_blocking_components(loop_detector, bconds):
     loops = set()
     seen = set()
     for component in loop_detector:
         if component not in seen:
-            _detect_loop(loop_detector, component, [component], loops, seen)
+            _detect_loop(loop_detector, bconds, component, [component], loops, seen)
     log('\nDetected dependency loops:')
-    for loop in sorted(loops, key=lambda t: -len(t)):
+    for loop in sorted(loops, key=lambda t: (-len(t), t)):
         log('    • ' + ' → '.join(loop))
 
-if __name__ == '__main__':
-    # this is spaghetti code that will be split into functions later:
-    from resolve_buildroot import resolve_buildrequires_of, resolve_requires
-    from bconds import bcond_cache_identifier, extract_buildrequires_if_possible
-
-    components = packages_to_rebuild(tuple(CONFIG['deps']['old']), excluded_components=tuple(CONFIG['components']['excluded']))
-    for component in CONFIG['components']['extra']:
-        components[component] = []
-    components_done = packages_built(tuple(CONFIG['deps']['new']), excluded_components=tuple(CONFIG['components']['excluded']))
-    binary_rpms = components.all_values()
-
-    blocker_counter = {
-        'general': collections.Counter(),
-        'single': collections.Counter(),
-        'combinations': collections.Counter(),
-    }
+def evaluate_campaign(campaign, *, only=(), shard=None):
+    """
+    Given a campaign (see utils.campaigns()),
+    resolves the buildroots of all its components (or only of the given component names,
+    or only of components in the given (index, count) shard, see shards.py)
+    and returns a dict with:
+     - positions: a dict of evaluated components to their positions in all components
+     - pruned: the number of components that were ready without resolving their buildroots
+       (their buildroots are assumed installable, see below)
+     - ready: a list of components and bcond identifiers that can be rebuilt now
+     - ready_alternatives: the same, but for buildroots with alternative providers
+     - blocker_counter: a dict of Counters of blocking components
+     - loop_detector: a dict of components to their blocking components
+     - buildroots: a dict of components and bcond identifiers to their relevant and blocking components
+
+    The sacks and the resolved buildroots are cached, so they are shared by all campaigns.
+
+    Components whose buildroots cannot contain anything to rebuild (see resolve_buildroot.may_reach())
+    are ready without resolving their buildroots. This is a deliberate over-approximation:
+    a buildroot that is not installable for other reasons (e.g. conflicts or broken dependencies)
+    would not be caught, but such a component cannot be rebuilt in any order anyway.
+    BuildRequires without any provider are still caught, as may_reach() does not prune those.
+    """
+    from resolve_buildroot import buildrequires_of, may_reach, resolve_requires, resolve_requires_avoiding
+    from resolve_buildroot import resolve_requires_from
+    from bconds import extract_buildrequires_if_possible
+
+    excluded_components = tuple(campaign['components']['excluded'])
+    components = packages_to_rebuild(tuple(campaign['deps']['old']),
+                                     excluded_components=excluded_components,
+                                     extra_components=tuple(campaign['components']['extra']))
+    components_done = packages_built(tuple(campaign['deps']['new']),
+                                     excluded_components=excluded_components,
+                                     repo_key=campaign['target_repos'])
+    # hashable, may_reach() caches on it
+    binary_rpms = frozenset(components.all_values())
+
+    positions = {}
+    pruned = 0
+    ready = []
+    ready_alternatives = []
+    blocker_counter = new_blocker_counter()
     loop_detector = {}
+    buildroots = {}
+    # components with no ready buildroot: component -> list of (bcond identifier or None, requires)
+    blocked = {}
 
-    for component in components:
-        if len(sys.argv) > 1 and component not in sys.argv[1:]:
+    for position, component in enumerate(components):
+        if only and component not in only:
+            continue
+        if shard and not in_shard(component, shard):
             continue
+        positions[component] = position
 
         try:
-            component_buildroot = resolve_buildrequires_of(component)
+            component_requires = buildrequires_of(component)
+            if may_reach(component_requires, binary_rpms):
+                component_buildroot = resolve_requires(component_requires)
+            else:
+                # the buildroot cannot contain anything to rebuild, so no need to resolve it
+                # (its installability is not checked, see the docstring)
+                log(f'  • {component}: no BuildRequires can pull in packages to rebuild, assuming installable')
+                component_buildroot = []
+                pruned += 1
         except ValueError as e:
             log(f'\n  ✗ {e}')
             continue
 
         ready_to_rebuild = are_all_done(
+            component=component,
             packages_to_check=set(component_buildroot) & binary_rpms,
             all_components=components,
             components_done=components_done,
             blocker_counter=blocker_counter,
             loop_detector=loop_detector,
+            buildroots=buildroots,
         )
 
         if ready_to_rebuild:
             # XXX make this configurable
             if component not in components_done:
-                print(component)
-        elif component in CONFIG['bconds']:
-            for bcond_config in CONFIG['bconds'][component]:
-                bcond_config['id'] = bcond_cache_identifier(component, bcond_config)
-                log(f'• {component} not ready and {bcond_config["id"]} bcond found, will check that one')
-                if 'buildrequires' not in bcond_config:
-                    extract_buildrequires_if_possible(component, bcond_config)
-                if 'buildrequires' in bcond_config:
-                    try:
-                        component_buildroot = resolve_requires(tuple(sorted(bcond_config['buildrequires'])))
-                    except ValueError as e:
-                        log(f'\n  ✗ {e}')
-                        continue
-                    ready_to_rebuild = are_all_done(
-                        packages_to_check=set(component_buildroot) & binary_rpms,
-                        all_components=components,
-                        components_done=components_done,
-                        blocker_counter=blocker_counter,
-                        loop_detector=loop_detector,
-                    )
-                    if ready_to_rebuild:
-                        if component not in components_done:
-                            print(bcond_config['id'])
-                else:
-                    log(f' • {bcond_config["id"]} bcond SRPM not present yet, skipping')
+                ready.append(component)
+            continue
+
+        blocked[component] = [(None, component_requires)]
+        for bcond in campaign['bconds'].get(component, ()):
+            log(f'• {component} not ready and {bcond.id} bcond found, will check that one')
+            if (bcond_buildrequires := extract_buildrequires_if_possible(bcond)) is None:
+                log(f' • {bcond.id} bcond SRPM not present yet, skipping')
+                continue
+            bcond_requires = tuple(sorted(bcond_buildrequires))
+            try:
+                # the bcond BuildRequires usually differ only slightly
+                component_buildroot = resolve_requires_from(component_requires, bcond_requires)
+            except ValueError as e:
+                log(f'\n  ✗ {e}')
+                continue
+            ready_to_rebuild = are_all_done(
+                component=component,
+                packages_to_check=set(component_buildroot) & binary_rpms,
+                all_components=components,
+                components_done=components_done,
+                blocker_counter=blocker_counter,
+                loop_detector=loop_detector,
+                buildroots=buildroots,
+                variant=bcond.id,
+            )
+            if ready_to_rebuild:
+                blocked.pop(component, None)
+                if component not in components_done:
+                    ready.append(bcond.id)
+            elif component in blocked:
+                blocked[component].append((bcond.id, bcond_requires))
+
+    # The resolver picks one provider for each requirement, but it might not be the only one.
+    # Re-resolve the blocked buildroots with all not-yet-rebuilt packages unavailable
+    # and with the target repos available (they might have providers rawhide does not have),
+    # if that works, the component can be rebuilt with alternative providers.
+    # The buildroots recorded for the index stay the ones the resolver picks from rawhide.
+    log(f'\n• Searching alternative providers for {len(blocked)} blocked components')
+    alternative_buildroots = resolve_requires_avoiding(
+        (requires for candidates in blocked.values() for _, requires in candidates),
+        packages_not_done(components, components_done),
+        repo_key=campaign['target_repos'],
+    )
+    for component, candidates in blocked.items():
+        for variant, requires in candidates:
+            if requires in alternative_buildroots:
+                log(f'  • {variant or component} is ready with alternative providers')
+                if component not in components_done:
+                    ready_alternatives.append(variant or component)
+                break
+
+    return {
+        'positions': positions,
+        'pruned': pruned,
+        'ready': ready,
+        'ready_alternatives': ready_alternatives,
+        'blocker_counter': blocker_counter,
+        'loop_detector': loop_detector,
+        'buildroots': buildroots,
+    }
+
+
+def report(results, bconds):
+    """
+    Logs the blocking components and loops from the results of evaluate_campaign().
+    """
+    blocker_counter = results['blocker_counter']
+
+    log(f'\n{results["pruned"]} of {len(results["positions"])} components '
+        f'did not need their buildroots resolved (no BuildRequires can pull in packages to rebuild), '
+        f'their buildroots were assumed installable.')
 
     log('\nThe 50 most commonly needed components are:')
-    for component, count in blocker_counter['general'].most_common(50):
+    for component, count in most_common(blocker_counter['general'], 50):
         log(f'{count:>5} {component}')
 
     log('\nThe 20 most commonly last-blocking components are:')
-    for component, count in blocker_counter['single'].most_common(20):
+    for component, count in most_common(blocker_counter['single'], 20):
         log(f'{count:>5} {component}')
 
     log('\nThe 20 most commonly last-blocking small combinations of components are:')
-    for components, count in blocker_counter['combinations'].most_common(20):
+    for components, count in most_common(blocker_counter['combinations'], 20):
         log(f'{count:>5} {", ".join(components)}')
 
-    report_blocking_components(loop_detector)
+    report_blocking_components(results['loop_detector'], bconds)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Print components (and bcond identifiers) that can be rebuilt now.')
+    parser.add_argument('components', nargs='*',
+                        help='only evaluate those components (default: all)')
+    parser.add_argument('--campaign', action='append', dest='campaigns', metavar='NAME',
+                        help='only evaluate this campaign, can be repeated (default: all)')
+    parser.add_argument('--shard', type=parse_shard, metavar='INDEX/COUNT',
+                        help='only evaluate components in this shard (e.g. 0/4), requires --output')
+    parser.add_argument('--output', metavar='PATH',
+                        help='write partial results of the shard to this file instead of reporting')
+    parser.add_argument('--merge', nargs='+', metavar='PATH',
+                        help='merge and report partial results of all shards instead of evaluating')
+    args = parser.parse_args()
+    if bool(args.shard) != bool(args.output):
+        parser.error('--shard and --output must be used together')
+    if args.merge and args.shard:
+        parser.error('--merge cannot be used with --shard')
+
+    all_campaigns = campaigns()
+    selected = args.campaigns or list(all_campaigns)
+    if unknown := set(selected) - set(all_campaigns):
+        parser.error(f'Unknown campaigns: {", ".join(sorted(unknown))}')
+
+    if args.merge:
+        all_results = merge_results(load_results(pathlib.Path(path).read_text()) for path in args.merge)
+        selected = [name for name in selected if name in all_results]
+    else:
+        all_results = {}
+        for name in selected:
+            if len(all_campaigns) > 1:
+                log(f'\n• Evaluating campaign {name}')
+            all_results[name] = evaluate_campaign(all_campaigns[name], only=args.components, shard=args.shard)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            fp.write(dump_results(all_results, args.shard))
+        log(f'\n• Partial results of shard {args.shard[0]}/{args.shard[1]} written to {args.output}')
+    else:
+        for name in selected:
+            results = all_results[name]
+            if len(all_campaigns) > 1:
+                print(f'# {name}')
+            for identifier in results['ready'] + results['ready_alternatives']:
+                print(identifier, flush=True)
+            report(results, all_campaigns[name]['bconds'])
+            if not args.components:
+                # a partial index would give wrong answers, see dependents.py
+                save_index(build_index(results['buildroots']), name)
@@ -1,11 +1,12 @@
+import contextlib
 import functools
 import sys
 
 import dnf
 import hawkey
 
-from sacks import rawhide_sack, rawhide_group
-from utils import log, stringify
+from sacks import MULTILIB, rawhide_sack, rawhide_group, target_repos_included
+from utils import CONFIG, log, stringify
 
 # Some deps are only pulled in when those are installed:
 DEFAULT_GROUPS = (
@@ -70,19 +71,7 @@ def buildrequires_of(package_name, extra_requires=()):
     )
 
 
-@functools.cache
-def resolve_requires(requires, ignore_weak_deps=True):
-    """
-    Given a hashable collection of requirements,
-    resolves all of them and the default buildroot packages in the rawhide repos
-    and returns a list of hawkey.Packages (in implicit hawkey order) to be installed.
-
-    If ignore_weak_deps is true (the default), weak dependencies (e.g. Recommends) are ignored,
-    which is what happens in mock/Koji as well.
-
-    If hawkey wants to upgrade or erase stuff, something is wrong with the setup -> RuntimeError.
-    If hawkey cannot resolve the set, the requires are not installable -> ValueError.
-    """
+def _solve(requires, ignore_weak_deps):
     sack = rawhide_sack()
     goal = hawkey.Goal(sack)
     orig_len = len(requires)
@@ -99,6 +88,194 @@ def resolve_requires(requires, ignore_weak_deps=True):
     return goal.list_installs()
 
 
+@functools.cache
+def resolve_requires(requires, ignore_weak_deps=True):
+    """
+    Given a hashable collection of requirements,
+    resolves all of them and the default buildroot packages in the rawhide repos
+    and returns a list of hawkey.Packages (in implicit hawkey order) to be installed.
+
+    If ignore_weak_deps is true (the default), weak dependencies (e.g. Recommends) are ignored,
+    which is what happens in mock/Koji as well.
+
+    If hawkey wants to upgrade or erase stuff, something is wrong with the setup -> RuntimeError.
+    If hawkey cannot resolve the set, the requires are not installable -> ValueError.
+    """
+    return _solve(requires, ignore_weak_deps)
+
+
+@contextlib.contextmanager
+def _excluded(sack, query):
+    """
+    Temporarily excludes the packages of the given query from the given sack.
+    Nothing else may use the sack in the meantime.
+    """
+    sack.add_excludes(query)
+    try:
+        yield
+    finally:
+        sack.remove_excludes(query)
+
+
+@functools.cache
+def _resolve_requires_excluding(requires, avoided_names, repo_key, ignore_weak_deps):
+    # only to be called from resolve_requires_avoiding() with the target repos included
+    # and avoided_names excluded from the sack
+    return _solve(requires, ignore_weak_deps)
+
+
+def resolve_requires_avoiding(requires_batch, avoided_names, *, repo_key='target', ignore_weak_deps=True):
+    """
+    Given an iterable of hashable collections of requirements and a collection of package names to avoid,
+    resolves each of the requirements like resolve_requires() does, but with the avoided packages unavailable
+    and with the packages from the given target repos available (see sacks.target_repos_included()).
+    This finds alternative providers of the requirements if there are any,
+    including those that only exist in the target repos (e.g. compat or renamed packages).
+
+    Returns a dict of requirements to lists of hawkey.Packages to be installed,
+    requirements that cannot be resolved without the avoided packages are omitted.
+
+    The packages are avoided by name, in all versions and in both rawhide and the target repos,
+    as the target repos might contain old builds of them (e.g. when they inherit from rawhide).
+    The target repos are included and the avoided packages are excluded once for the whole batch.
+    The results are cached (per avoided names and target repos), as are the buildroot group packages.
+    """
+    avoided_names = frozenset(avoided_names)
+    results = {}
+    with target_repos_included(repo_key) as sack:
+        with _excluded(sack, sack.query(flags=hawkey.IGNORE_EXCLUDES).filter(name=sorted(avoided_names))):
+            for requires in requires_batch:
+                try:
+                    results[requires] = _resolve_requires_excluding(requires, avoided_names, repo_key,
+                                                                    ignore_weak_deps)
+                except ValueError as e:
+                    log(f'\n  ✗ {e}')
+    return results
+
+
+@functools.cache
+def packages_reaching(packages):
+    """
+    Given a hashable collection of binary hawkey.Packages from rawhide,
+    returns a frozenset of all binary packages in rawhide that can pull them in,
+    i.e. they transitively require any of them (including the given packages).
+
+    This is an over-approximation of what the solver does:
+    all providers of each requirement are considered, not just the ones the solver would pick.
+    Weak dependencies are not followed, as they are ignored in the buildroot.
+    The reverse closure is computed once per given collection,
+    using the whatrequires index of the sack.
+    """
+    sack = rawhide_sack()
+    log(f'• Finding packages that can pull in {len(packages)} packages...', end=' ')
+    binaries = sack.query().filter(arch__neq='src')
+    reaching = binaries.filter(pkg=list(packages))
+    frontier = reaching
+    while frontier:
+        frontier = binaries.filter(requires=frontier).difference(reaching)
+        reaching = reaching.union(frontier)
+    log(f'found {len(reaching)}.')
+    return frozenset(reaching)
+
+
+@functools.cache
+def _providers(dep):
+    sack = rawhide_sack()
+    if dep.startswith('/'):
+        return frozenset(sack.query().filter(file=dep, arch__neq='src'))
+    return frozenset(sack.query().filter(provides=dep, arch__neq='src'))
+
+
+def may_reach(requires, packages):
+    """
+    Given a collection of requirements and a hashable collection of binary hawkey.Packages,
+    returns False if no buildroot resolved from the requirements can contain any of the packages
+    (i.e. resolve_requires() would return no such packages), True if it might.
+
+    This is much cheaper than resolving the requirements, see packages_reaching() for details.
+    Rich dependencies and requirements without providers are conservatively considered reaching.
+    """
+    reaching = packages_reaching(packages)
+    for dep in tuple(requires) + tuple(mandatory_packages_in_groups()):
+        if dep.startswith('('):
+            return True
+        providers = _providers(dep)
+        if not providers or not providers.isdisjoint(reaching):
+            return True
+    return False
+
+
+@functools.cache
+def _installable_providers(dep):
+    multilib = MULTILIB.get(CONFIG['architectures']['repoquery'])
+    return frozenset(p for p in _providers(dep) if p.arch != multilib)
+
+
+def _closure_within(requires, base_installs):
+    """
+    Returns a set of packages from base_installs that provide the given requirements
+    and (transitively) their requirements, i.e. what the solver keeps from the base buildroot.
+    Returns None if any of the requirements is not satisfied by base_installs
+    (a new package is needed, the solver has to pick it)
+    or the requirement is conditional (a rich dependency with if/unless/and).
+
+    When a requirement is satisfied by multiple packages from base_installs,
+    it is only checked at the end whether any of them was needed for other requirements,
+    if not, None is returned as well (it is not known which one the solver would keep).
+    """
+    closure = set()
+    queue = list(requires)
+    ambiguous = []
+    while queue:
+        dep = queue.pop()
+        if dep.startswith('rpmlib('):
+            continue  # not considered by the solver
+        if dep.startswith('(') and any(op in dep for op in (' if ', ' unless ', ' and ')):
+            return None
+        candidates = _installable_providers(dep) & base_installs
+        if not candidates:
+            return None
+        if not candidates.isdisjoint(closure):
+            continue
+        if len(candidates) > 1:
+            ambiguous.append(candidates)
+            continue
+        package, = candidates
+        closure.add(package)
+        queue += (str(r) for r in package.requires)
+    if any(candidates.isdisjoint(closure) for candidates in ambiguous):
+        return None
+    return closure
+
+
+@functools.cache
+def resolve_requires_from(base_requires, requires, ignore_weak_deps=True):
+    """
+    Given hashable collections of requirements of an already resolvable buildroot (base_requires)
+    and similar requirements (e.g. of a bcond variant of the same component),
+    returns what resolve_requires(requires) would, but reuses the base buildroot when possible.
+
+    If the requirements are the same, the (cached) base buildroot is returned.
+    Otherwise, the requirements are followed within the base buildroot (see _closure_within()),
+    the solver is not run when all of them (transitively, including the default buildroot packages)
+    are satisfied by the base buildroot -- e.g. when the variant only drops some requirements.
+    This assumes the solver keeps its choices among multiple providers when requirements are dropped,
+    benchmark.py and the tests verify that on real data.
+    In any other case (e.g. added requirements not satisfied by the base buildroot),
+    the requirements are resolved from scratch.
+    """
+    base_installs = resolve_requires(base_requires, ignore_weak_deps=ignore_weak_deps)
+    if set(requires) == set(base_requires):
+        return base_installs
+    if ignore_weak_deps:
+        # with weak dependencies, the solver can install more than the closure
+        closure = _closure_within(tuple(requires) + tuple(mandatory_packages_in_groups()), frozenset(base_installs))
+        if closure is not None:
+            log(f'• Reused {len(closure)} of {len(base_installs)} installs of a similar buildroot.')
+            return [p for p in base_installs if p in closure]
+    return resolve_requires(requires, ignore_weak_deps=ignore_weak_deps)
+
+
 @functools.cache
 def resolve_buildrequires_of(package_name, *, extra_requires=(), ignore_weak_deps=True):
     """
@@ -1,37 +1,72 @@
+import contextlib
 import functools
 
-import dnf
-
-from utils import CONFIG, log
+from utils import CONFIG, CONFIG_PATH, campaigns, log
 
 MULTILIB = {'x86_64': 'i686'} # architectures to exclude in certain queries
 
 @functools.cache
-def _base(repo_key):
+def _base(*repo_keys):
     f"""
-    Creates a DNF base from repositories defined in CONFIG['repos'], based on the given key.
+    Creates a DNF base from repositories defined in CONFIG['repos'], based on the given keys.
     The sack is filled, which can be extremely slow if not already cached on disk in {CONFIG['cache_dir']['dnf']}.
     Cache is never invalidated here, remove the directory manually if needed.
     """
+    # imported here, so the sack-less parts of jobs.py can be used (and tested) without DNF
+    import dnf
+
     base = dnf.Base()
     dnf_conf = base.conf
     dnf_conf.arch = CONFIG['architectures']['repoquery']
     dnf_conf.cachedir = CONFIG['cache_dir']['dnf']
     dnf_conf.substitutions['releasever'] = 'rawhide'
     dnf_conf.substitutions['basearch'] = CONFIG['architectures']['repoquery']
-    for repo in CONFIG['repos'][repo_key]:
-        base.repos.add_new_repo(conf=dnf_conf, skip_if_unavailable=False, **repo)
-    log(f'• Filling the DNF {repo_key} sack to/from {CONFIG["cache_dir"]["dnf"]}...', end=' ')
+    # allows local repos next to the config, e.g. file://$configdir/repos/rawhide/
+    dnf_conf.substitutions['configdir'] = str(CONFIG_PATH.parent.absolute())
+    for repo_key in repo_keys:
+        for repo in CONFIG['repos'][repo_key]:
+            if repo['repoid'] not in base.repos:  # multiple campaigns may share target repos
+                base.repos.add_new_repo(conf=dnf_conf, skip_if_unavailable=False, **repo)
+    log(f'• Filling the DNF {"+".join(repo_keys)} sack to/from {CONFIG["cache_dir"]["dnf"]}...', end=' ')
     base.fill_sack(load_system_repo=False, load_available_repos=True)
     log('done.')
     return base
 
 
+def _target_repo_keys():
+    return tuple(sorted({campaign['target_repos'] for campaign in campaigns().values()} - {'rawhide'}))
+
+
+def _repo_packages(sack, repo_key):
+    """
+    Returns a query of all packages in the repos of the given key, excluded or not.
+    """
+    import hawkey
+
+    query = sack.query(flags=hawkey.IGNORE_EXCLUDES).filter(empty=True)
+    for repo in CONFIG['repos'][repo_key]:
+        query = query.union(sack.query(flags=hawkey.IGNORE_EXCLUDES).filter(reponame=repo['repoid']))
+    return query
+
+
+@functools.cache
+def _rawhide_base():
+    """
+    The rawhide DNF base. See base() for details.
+    The target repos of all campaigns are loaded into it as well (so they share the sack),
+    but their packages are excluded, see target_repos_included().
+    """
+    base = _base('rawhide', *_target_repo_keys())
+    for repo_key in _target_repo_keys():
+        base.sack.add_excludes(_repo_packages(base.sack, repo_key))
+    return base
+
+
 def rawhide_group(group_id):
     """
     Return a rawhide comps group of a given id (a.k.a. name)
     """
-    base = _base('rawhide')
+    base = _rawhide_base()
     log('• Reading the comps information...', end=' ')
     base.read_comps()
     log('done.')
@@ -45,11 +80,32 @@ def rawhide_sack():
     """
     A filled sack to perform rawhide repoquries. See base() for details.
     """
-    return _base('rawhide').sack
+    return _rawhide_base().sack
+
+
+def target_packages(repo_key='target'):
+    """
+    A query of all packages from the given target repos, to perform target repoquries.
+    The target repos are loaded in the rawhide sack (see _rawhide_base()), so this ignores their exclusion.
+    Campaigns with different target repos use different repo keys.
+    """
+    return _repo_packages(rawhide_sack(), repo_key)
 
 
-def target_sack():
+@contextlib.contextmanager
+def target_repos_included(repo_key='target'):
     """
-    A filled sack to perform target repoquries. See base() for details.
+    Temporarily makes the packages from the given target repos available in the rawhide sack.
+    Used to find providers that only exist in the target repos (e.g. renamed packages).
+    Nothing else may use the sack in the meantime, in particular not the cached resolver functions.
     """
-    return _base('target').sack
+    sack = rawhide_sack()
+    if repo_key not in _target_repo_keys():
+        yield sack  # e.g. rawhide itself, nothing to include
+        return
+    included = target_packages(repo_key)
+    sack.remove_excludes(included)
+    try:
+        yield sack
+    finally:
+        sack.add_excludes(included)
@@ -0,0 +1,133 @@
+import collections
+import json
+import zlib
+
+from utils import CONFIG
+
+
+def parse_shard(shard):
+    """
+    Parses a shard specification in the form of INDEX/COUNT (e.g. 0/4) to a tuple of integers.
+    Raises ValueError when the specification is not valid.
+    """
+    index, _, count = shard.partition('/')
+    index, count = int(index), int(count)
+    if not 0 <= index < count:
+        raise ValueError(f'Shard index must be between 0 and {count-1}, got {index}')
+    return index, count
+
+
+def in_shard(component, shard):
+    """
+    Returns True if the given component name belongs to the given (index, count) shard.
+    The assignment is deterministic across processes and hosts (unlike hash()).
+    """
+    index, count = shard
+    return zlib.crc32(component.encode()) % count == index
+
+
+def most_common(counter, n):
+    """
+    Like Counter.most_common(n), but ties are sorted by the keys
+    (instead of the insertion order, which differs between sharded and single-process runs).
+    """
+    return sorted(counter.items(), key=lambda item: (-item[1], item[0]))[:n]
+
+
+def _component_of(identifier):
+    # bcond identifiers start with the component name, see utils.Bcond
+    return identifier.partition(':')[0]
+
+
+def dump_results(results_by_campaign, shard):
+    """
+    Given a dict of campaign names to results of jobs.evaluate_campaign() of the given (index, count) shard,
+    returns a JSON string with the partial results, see merge_results().
+    """
+    return json.dumps({
+        'shard': shard,
+        'repos': CONFIG['repos'],
+        'campaigns': {
+            name: results | {
+                'blocker_counter': {
+                    kind: [[key, count] for key, count in counter.items()]
+                    for kind, counter in results['blocker_counter'].items()
+                },
+            }
+            for name, results in results_by_campaign.items()
+        },
+    }, indent=1)
+
+
+def load_results(text):
+    """
+    The inverse of dump_results(), returns the shard and the dict of campaign names to results.
+    """
+    partial = json.loads(text)
+    if partial['repos'] != CONFIG['repos']:
+        raise ValueError(f'Shard {partial["shard"]} was evaluated with different repos')
+    results_by_campaign = {}
+    for name, results in partial['campaigns'].items():
+        results['blocker_counter'] = {
+            kind: collections.Counter({tuple(key) if isinstance(key, list) else key: count
+                                       for key, count in counter})
+            for kind, counter in results['blocker_counter'].items()
+        }
+        results_by_campaign[name] = results
+    return tuple(partial['shard']), results_by_campaign
+
+
+def merge_results(partials):
+    """
+    Given an iterable of (shard, results_by_campaign) tuples as returned by load_results(),
+    merges the results of each campaign to what a single-process run would return.
+    All shards of the same count must be present exactly once, otherwise ValueError is raised.
+
+    The components keep their original order (by their positions),
+    ready components found by the regular and alternative buildroots stay separate.
+    """
+    shards = []
+    merged = {}
+    for shard, results_by_campaign in partials:
+        shards.append(shard)
+        for name, results in results_by_campaign.items():
+            campaign = merged.setdefault(name, {
+                'positions': {},
+                'pruned': 0,
+                'ready': [],
+                'ready_alternatives': [],
+                'blocker_counter': collections.defaultdict(collections.Counter),
+                'loop_detector': {},
+                'buildroots': {},
+            })
+            campaign['positions'] |= results['positions']
+            campaign['pruned'] += results['pruned']
+            campaign['ready'] += results['ready']
+            campaign['ready_alternatives'] += results['ready_alternatives']
+            for kind, counter in results['blocker_counter'].items():
+                campaign['blocker_counter'][kind] += counter
+            campaign['loop_detector'] |= results['loop_detector']
+            campaign['buildroots'] |= results['buildroots']
+
+    if not shards:
+        raise ValueError('No shards to merge')
+    count = shards[0][1]
+    if sorted(shards) != [(index, count) for index in range(count)]:
+        raise ValueError(f'Expected shards 0/{count} to {count-1}/{count} exactly once, '
+                         f'got {", ".join(f"{i}/{c}" for i, c in sorted(shards))}')
+
+    for campaign in merged.values():
+        positions = campaign['positions']
+
+        def position(identifier):
+            return positions[_component_of(identifier)]
+
+        # sorting is stable, so the order of bcond variants of one component is preserved
+        campaign['ready'].sort(key=position)
+        campaign['ready_alternatives'].sort(key=position)
+        campaign['blocker_counter'] = dict(campaign['blocker_counter'])
+        campaign['loop_detector'] = dict(sorted(campaign['loop_detector'].items(),
+                                                key=lambda item: positions[item[0]]))
+        campaign['buildroots'] = dict(sorted(campaign['buildroots'].items(),
+                                             key=lambda item: positions[item[1]['component']]))
+    return merged
@@ -0,0 +1,197 @@
+"""
+Captures the resolver golden set for the offline tests and benchmarks:
+ - snapshots of the repodata of the (pinned) rawhide repos from config.toml in fixtures/repos
+ - the packages mock installs from the snapshots for the BuildRequires of GOLDEN_PACKAGES in fixtures/expected.json
+ - the BuildRequires of the bconds from fixtures/config.toml in its fedpkg cache_dir
+
+Run it once from the repository root, with the regular config.toml,
+after bconds.py extracted the BuildRequires of the bconds:
+
+    $ python -m tests.capture_fixtures
+
+Afterwards, the tests use fixtures/config.toml, see conftest.py.
+"""
+import fcntl
+import json
+import pathlib
+import subprocess
+import tomllib
+import urllib.request
+import xml.etree.ElementTree as ET
+
+TESTS_DIR = pathlib.Path(__file__).parent
+FIXTURES_DIR = TESTS_DIR / 'fixtures'
+REPOS_DIR = FIXTURES_DIR / 'repos'
+EXPECTED_PATH = FIXTURES_DIR / 'expected.json'
+FIXTURES_CONFIG_PATH = FIXTURES_DIR / 'config.toml'
+MOCK_CONFIG_PATH = FIXTURES_DIR / 'mock.cfg'
+
+GOLDEN_PACKAGES = (
+    'pytest',
+    'python-setuptools',
+    'python-pip',
+    'rpm',
+)
+
+REPOMD_NS = {'repo': 'http://linux.duke.edu/metadata/repo'}
+
+# the [main] section is what the Fedora mock configs use
+MOCK_CONFIG = """\
+include('{include}.cfg')
+config_opts['root'] = 'whatdoibuild-fixtures-{arch}'
+config_opts['dnf.conf'] = '''
+[main]
+keepcache=1
+debuglevel=2
+reposdir=/dev/null
+logfile=/var/log/yum.log
+retries=20
+obsoletes=1
+gpgcheck=0
+assumeyes=1
+syslog_ident=mock
+syslog_device=
+install_weak_deps=0
+metadata_expire=0
+best=1
+protected_packages=
+{repos}'''
+"""
+
+
+def rawhide_mock():
+    from utils import CONFIG
+    return f'fedora-rawhide-{CONFIG["architectures"]["repoquery"]}'
+
+
+# XXX the mock tests are sloooooow
+# XXX sometimes, we might manually need to scrub our cache as well as mock's (--scrub=dnf-cache)
+def run_mock(*cmd, config=None, **kwargs):
+    kwargs.setdefault('check', True)
+    kwargs.setdefault('capture_output', True)
+    kwargs.setdefault('text', True)
+    return subprocess.run(['mock', '-r', config or rawhide_mock(), '--no-bootstrap-chroot',
+                           '--isolation=simple', *cmd], **kwargs)
+
+
+def resolve_buildroot_in_mock(package_name, config=None):
+    """
+    Returns a set of package names mock installs for the BuildRequires of the given package,
+    using the given mock config (path), live rawhide by default.
+    """
+    with open((TESTS_DIR / rawhide_mock()).with_suffix('.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        run_mock('--init', config=config)
+        run_mock('--update', config=config)
+        run_mock('--dnf-cmd', 'builddep', package_name, config=config)
+        packages = run_mock('--shell', 'rpm -qa --qf=%{NAME}\\\\n', config=config).stdout
+    return set(packages.splitlines()) - {'gpg-pubkey'}  # pubkey only installed in mock
+
+
+def write_snapshot_mock_config(repos):
+    """
+    Writes a mock config to MOCK_CONFIG_PATH, based on the rawhide one,
+    but with the repos replaced by the snapshots of the given repos (from CONFIG['repos']).
+    Returns its path.
+    """
+    from utils import CONFIG
+
+    repos_conf = ''.join(f'\n[{repo["repoid"]}]\n'
+                         f'name={repo["repoid"]} snapshot\n'
+                         f'baseurl=file://{(REPOS_DIR / repo["repoid"]).absolute()}/\n'
+                         f'enabled=1\n'
+                         for repo in repos)
+    MOCK_CONFIG_PATH.write_text(MOCK_CONFIG.format(include=rawhide_mock(),
+                                                   arch=CONFIG['architectures']['repoquery'],
+                                                   repos=repos_conf))
+    return MOCK_CONFIG_PATH
+
+
+def expected_buildroot(package_name):
+    """
+    Returns a set of package names mock installs for the BuildRequires of the given package,
+    from the captured golden set if it exists, from mock otherwise.
+    """
+    if EXPECTED_PATH.exists():
+        return set(json.loads(EXPECTED_PATH.read_text())[package_name])
+    return resolve_buildroot_in_mock(package_name)
+
+
+def repodata_fetch_jobs(baseurl, destination):
+    """
+    Returns the repomd.xml content of the repo at baseurl
+    and FetchJobs for the metadata files listed in it (with their sizes and checksums).
+    Changelogs and the sqlite/zchunk variants are not needed by the resolver, hence skipped.
+    """
+    from fetch import FetchJob
+
+    repomd = urllib.request.urlopen(f'{baseurl}repodata/repomd.xml').read()
+    jobs = []
+    for data in ET.fromstring(repomd).findall('repo:data', REPOMD_NS):
+        data_type = data.get('type')
+        if data_type.startswith('other') or data_type.endswith(('_db', '_zck')):
+            continue
+        href = data.find('repo:location', REPOMD_NS).get('href')
+        checksum = data.find('repo:checksum', REPOMD_NS)
+        jobs.append(FetchJob(
+            f'{baseurl}{href}',
+            destination / href,
+            size=int(data.find('repo:size', REPOMD_NS).text),
+            sha256=checksum.text if checksum.get('type') == 'sha256' else None,
+        ))
+    return repomd, jobs
+
+
+def snapshot_repos(repos):
+    """
+    Downloads the repodata of the given repos (from CONFIG['repos']) to REPOS_DIR/repoid.
+    The repomd.xml is written last, so an interrupted snapshot is not a valid repo.
+    """
+    from fetch import fetch_all
+    from utils import CONFIG, log
+
+    for repo in repos:
+        baseurl = repo['baseurl'][0].replace('$basearch', CONFIG['architectures']['repoquery'])
+        destination = REPOS_DIR / repo['repoid']
+        (destination / 'repodata').mkdir(parents=True, exist_ok=True)
+        log(f'• Snapshotting {repo["repoid"]} from {baseurl}')
+        repomd, jobs = repodata_fetch_jobs(baseurl, destination)
+        if len(fetch_all(jobs, workers=CONFIG['fetch']['workers'], retries=CONFIG['fetch']['retries'])) != len(jobs):
+            raise RuntimeError(f'Cannot snapshot {repo["repoid"]}')
+        (destination / 'repodata' / 'repomd.xml').write_bytes(repomd)
+
+
+def capture_bcond_buildrequires():
+    """
+    Stores the BuildRequires of the bconds from fixtures/config.toml
+    (as extracted by bconds.py with the regular config, or evaluated locally with rpmspec)
+    to the fedpkg cache_dir of fixtures/config.toml, where bconds.py finds them offline.
+    """
+    from bconds import BUILDREQUIRES_FILENAME, extract_buildrequires_if_possible, local_buildrequires_if_possible
+    from utils import _parse_bconds, log
+
+    fixtures_config = tomllib.loads(FIXTURES_CONFIG_PATH.read_text())
+    for bconds in _parse_bconds(fixtures_config['bconds']).values():
+        for bcond in bconds:
+            buildrequires = extract_buildrequires_if_possible(bcond)
+            if buildrequires is None and local_buildrequires_if_possible(bcond):
+                buildrequires = extract_buildrequires_if_possible(bcond)
+            if buildrequires is None:
+                raise RuntimeError(f'No BuildRequires of {bcond.id} yet, run bconds.py first')
+            destination = FIXTURES_CONFIG_PATH.parent / fixtures_config['cache_dir']['fedpkg'] / bcond.id
+            destination.mkdir(parents=True, exist_ok=True)
+            (destination / BUILDREQUIRES_FILENAME).write_text(''.join(f'{br}\n' for br in buildrequires))
+            log(f'• Stored {len(buildrequires)} BuildRequires of {bcond.id}')
+
+
+if __name__ == '__main__':
+    from utils import CONFIG
+
+    capture_bcond_buildrequires()
+    snapshot_repos(CONFIG['repos']['rawhide'])
+    # mock resolves from the snapshots, so the golden set matches the repodata the tests use
+    mock_config = write_snapshot_mock_config(CONFIG['repos']['rawhide'])
+    run_mock('--scrub=all', config=mock_config)  # a previous snapshot might be cached
+    expected = {package_name: sorted(resolve_buildroot_in_mock(package_name, config=mock_config))
+                for package_name in GOLDEN_PACKAGES}
+    EXPECTED_PATH.write_text(json.dumps(expected, indent=1))
@@ -0,0 +1,14 @@
+import os
+import pathlib
+
+# This must happen before utils is imported (by any test module), as it loads the config.
+# When the resolver golden set was captured (see capture_fixtures.py), the tests run offline against it.
+FIXTURES_DIR = pathlib.Path(__file__).parent / 'fixtures'
+if (FIXTURES_DIR / 'expected.json').exists():
+    os.environ.setdefault('WHATDOIBUILD_CONFIG', str(FIXTURES_DIR / 'config.toml'))
+
+# Parallel pytest-xdist workers would fill and read the same DNF cache at once, which is not known to be safe.
+# Each worker gets a cache of its own (filling it from the snapshot does not need network).
+if worker := os.environ.get('PYTEST_XDIST_WORKER'):
+    import utils
+    utils.CONFIG['cache_dir']['dnf'] = str(pathlib.Path(utils.CONFIG['cache_dir']['dnf']) / worker)
@@ -0,0 +1,26 @@
+Name:           sample-dynamic
+Version:        1.0
+Release:        1%{?dist}
+Summary:        A sample package with dynamic BuildRequires
+License:        MIT
+
+%bcond_with bootstrap
+
+BuildArch:      noarch
+BuildRequires:  python3-devel
+
+%description
+A sample package with dynamic BuildRequires.
+
+%prep
+
+%if %{without bootstrap}
+%generate_buildrequires
+%pyproject_buildrequires
+%endif
+
+%build
+
+%install
+
+%files
@@ -0,0 +1,32 @@
+Name:           sample
+Version:        1.0
+Release:        1%{?dist}
+Summary:        A sample package with bconds
+License:        MIT
+
+%bcond_without tests
+%bcond_with bootstrap
+%global with_docs 1
+
+BuildArch:      noarch
+BuildRequires:  python3-devel
+%if %{with tests}
+BuildRequires:  python3-pytest
+%endif
+%if %{without bootstrap}
+BuildRequires:  python3-setuptools_scm
+%endif
+%if %{with_docs}
+BuildRequires:  python3-sphinx
+%endif
+
+%description
+A sample package with bconds.
+
+%prep
+
+%build
+
+%install
+
+%files
@@ -0,0 +1,122 @@
+import pathlib
+import shutil
+
+import pytest
+
+import bconds
+from bconds import BcondState
+from bconds import has_dynamic_buildrequires
+from bconds import patched_spec_text
+from bconds import scratchbuild_patched_if_needed
+from bconds import spec_buildrequires
+from bconds import srpm_fetch_job_if_possible
+from fetch import FetchJob
+from utils import CONFIG, Bcond
+
+
+SPECS_DIR = pathlib.Path(__file__).parent / 'specs'
+
+needs_rpmspec = pytest.mark.skipif(shutil.which('rpmspec') is None, reason='rpmspec is not installed')
+
+
+def patched_spec(tmp_path, name, bcond_config):
+    specpath = tmp_path / f'{name}.spec'
+    bcond = Bcond.from_config(name, bcond_config)
+    specpath.write_text(patched_spec_text((SPECS_DIR / f'{name}.spec').read_text(), bcond))
+    return specpath
+
+
+@pytest.mark.parametrize('bcond_config, expected', [
+    ({}, ('python3-devel', 'python3-pytest', 'python3-setuptools_scm', 'python3-sphinx')),
+    ({'withouts': ['tests']}, ('python3-devel', 'python3-setuptools_scm', 'python3-sphinx')),
+    ({'withs': ['bootstrap']}, ('python3-devel', 'python3-pytest', 'python3-sphinx')),
+    ({'replacements': {'with_docs': '0'}}, ('python3-devel', 'python3-pytest', 'python3-setuptools_scm')),
+    ({'withs': ['bootstrap'], 'withouts': ['tests'], 'replacements': {'with_docs': '0'}}, ('python3-devel',)),
+])
+@needs_rpmspec
+def test_spec_buildrequires(tmp_path, bcond_config, expected):
+    specpath = patched_spec(tmp_path, 'sample', bcond_config)
+    assert not has_dynamic_buildrequires(specpath)
+    assert spec_buildrequires(specpath) == expected
+
+
+@pytest.mark.parametrize('bcond_config, expected', [
+    ({}, True),
+    ({'withs': ['bootstrap']}, False),
+])
+@needs_rpmspec
+def test_has_dynamic_buildrequires(tmp_path, bcond_config, expected):
+    specpath = patched_spec(tmp_path, 'sample-dynamic', bcond_config)
+    assert has_dynamic_buildrequires(specpath) is expected
+
+
+def test_koji_pass_sees_updates_pulled_by_local_pass(tmp_path, monkeypatch):
+    bcond = Bcond('python-setuptools', withouts=('tests',))
+    repopath = tmp_path / bcond.id
+    repopath.mkdir()
+    (repopath / 'python-setuptools-1-1.src.rpm').touch()  # built from the old commit
+    refreshes = iter([True])  # only the first refresh pulls new commits
+    submitted = []
+    monkeypatch.setattr(bconds, 'STATE', BcondState())
+    monkeypatch.setattr(bconds, 'repo_path', lambda bcond: repopath)
+    monkeypatch.setattr(bconds, 'clone_or_refresh', lambda *args, **kwargs: next(refreshes, False))
+    monkeypatch.setattr(bconds, 'patch_spec', lambda specpath, bcond: None)
+    monkeypatch.setattr(bconds, 'has_dynamic_buildrequires', lambda specpath: True)
+    monkeypatch.setattr(bconds, 'submit_scratchbuild', lambda repopath, target: submitted.append(repopath) or '42')
+
+    assert not bconds.local_buildrequires_if_possible(bcond)
+    assert scratchbuild_patched_if_needed(bcond)
+    assert submitted == [repopath]
+    assert bconds.srpm_path(repopath) is None
+    assert bconds.STATE.get(bcond, 'koji_task_id') == '42'
+
+
+def test_stored_empty_buildrequires_are_reused(tmp_path, monkeypatch):
+    bcond = Bcond('python-foo', withouts=('tests',))
+    (tmp_path / bconds.BUILDREQUIRES_FILENAME).write_text('')
+    monkeypatch.setattr(bconds, 'STATE', BcondState())
+    monkeypatch.setattr(bconds, 'repo_path', lambda bcond: tmp_path)
+    monkeypatch.setattr(bconds, 'clone_or_refresh', lambda *args, **kwargs: False)
+    monkeypatch.setattr(bconds, 'patch_spec', lambda specpath, bcond: pytest.fail('the spec was parsed again'))
+
+    assert bconds.local_buildrequires_if_possible(bcond)
+    assert bconds.STATE.get(bcond, 'buildrequires') == ()
+
+
+KOJI_OUTPUTS = {
+    'getTaskChildren': {'12345': [{'id': 12346}]},
+    'listTaskOutput': {
+        '12345': {},
+        '12346': {'build.log': {'st_size': '10'}, 'python-foo-1.0-1.src.rpm': {'st_size': '1234'}},
+    },
+}
+
+
+@pytest.fixture
+def koji_task(tmp_path, monkeypatch):
+    bcond = Bcond('python-foo', withs=('bootstrap',))
+    monkeypatch.setattr(bconds, 'STATE', BcondState())
+    monkeypatch.setattr(bconds, 'repo_path', lambda bcond: tmp_path)
+    monkeypatch.setattr(bconds, 'koji_status', lambda koji_id: 'closed')
+    monkeypatch.setattr(bconds, 'koji_call', lambda method, task_id, *args: KOJI_OUTPUTS[method][task_id])
+    bconds.STATE.set(bcond, 'koji_task_id', '12345')
+    return bcond
+
+
+def test_srpm_fetch_job(koji_task, tmp_path):
+    assert srpm_fetch_job_if_possible(koji_task) == FetchJob(
+        f'{CONFIG["koji"]["topurl"]}/work/tasks/2346/12346/python-foo-1.0-1.src.rpm',
+        tmp_path / 'python-foo-1.0-1.src.rpm',
+        size=1234,
+    )
+
+
+def test_srpm_fetch_job_not_closed(koji_task, monkeypatch):
+    monkeypatch.setattr(bconds, 'koji_status', lambda koji_id: 'open')
+    assert srpm_fetch_job_if_possible(koji_task) is None
+
+
+def test_srpm_fetch_job_without_srpm(koji_task, monkeypatch):
+    monkeypatch.setitem(KOJI_OUTPUTS['listTaskOutput'], '12346', {'build.log': {'st_size': '10'}})
+    with pytest.raises(RuntimeError):
+        srpm_fetch_job_if_possible(koji_task)
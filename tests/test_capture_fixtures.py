@@ -0,0 +1,39 @@
+from capture_fixtures import repodata_fetch_jobs
+
+
+REPOMD = '''<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo" xmlns:rpm="http://linux.duke.edu/metadata/rpm">
+  <data type="primary">
+    <checksum type="sha256">aaaa</checksum>
+    <location href="repodata/aaaa-primary.xml.gz"/>
+    <size>123</size>
+  </data>
+  <data type="other">
+    <checksum type="sha256">bbbb</checksum>
+    <location href="repodata/bbbb-other.xml.gz"/>
+    <size>456</size>
+  </data>
+  <data type="primary_zck">
+    <checksum type="sha256">cccc</checksum>
+    <location href="repodata/cccc-primary.xml.zck"/>
+    <size>789</size>
+  </data>
+  <data type="group">
+    <checksum type="sha1">dddd</checksum>
+    <location href="repodata/dddd-comps.xml"/>
+    <size>1011</size>
+  </data>
+</repomd>
+'''
+
+
+def test_repodata_fetch_jobs(tmp_path):
+    (tmp_path / 'repodata').mkdir()
+    (tmp_path / 'repodata' / 'repomd.xml').write_text(REPOMD)
+    baseurl = f'file://{tmp_path}/'
+    repomd, jobs = repodata_fetch_jobs(baseurl, tmp_path / 'snapshot')
+    assert repomd.decode() == REPOMD
+    assert [(job.url, job.destination, job.size, job.sha256) for job in jobs] == [
+        (f'{baseurl}repodata/aaaa-primary.xml.gz', tmp_path / 'snapshot/repodata/aaaa-primary.xml.gz', 123, 'aaaa'),
+        (f'{baseurl}repodata/dddd-comps.xml', tmp_path / 'snapshot/repodata/dddd-comps.xml', 1011, None),
+    ]
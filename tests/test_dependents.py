@@ -0,0 +1,85 @@
+import collections
+
+import pytest
+
+from dependents import build_index, dependents_of, newly_ready
+from jobs import ReverseLookupDict, are_all_done, new_blocker_counter
+
+
+def buildroot(component, requires, blocking, *, variant=None, done=False):
+    return {
+        'component': component,
+        'variant': variant,
+        'requires': requires,
+        'blocking': blocking,
+        'done': done,
+    }
+
+
+@pytest.fixture
+def index():
+    return build_index({
+        'python-setuptools': buildroot('python-setuptools', ['python-wheel'], ['python-wheel']),
+        'python-setuptools:tests:bootstrap:::': buildroot(
+            'python-setuptools', [], [], variant='python-setuptools:tests:bootstrap:::'),
+        'python-wheel': buildroot('python-wheel', ['python-setuptools'], ['python-setuptools']),
+        'python-wheel::bootstrap:::': buildroot(
+            'python-wheel', ['python-setuptools'], ['python-setuptools'], variant='python-wheel::bootstrap:::'),
+        'python-pip': buildroot('python-pip', ['python-setuptools', 'python-wheel'], ['python-setuptools', 'python-wheel']),
+        'python-six': buildroot('python-six', ['python-setuptools'], [], done=True),
+        'python-attrs': buildroot('python-attrs', ['python-setuptools'], []),
+    })
+
+
+def test_dependents_of(index):
+    assert dependents_of(index, 'python-setuptools') == [
+        'python-attrs',
+        'python-pip',
+        'python-six',
+        'python-wheel',
+        'python-wheel::bootstrap:::',
+    ]
+
+
+def test_dependents_of_nothing(index):
+    assert dependents_of(index, 'python-pip') == []
+
+
+def test_newly_ready_prefers_regular_buildroots(index):
+    assert newly_ready(index, ['python-setuptools']) == ['python-wheel']
+
+
+def test_newly_ready_needs_all_blockers(index):
+    assert newly_ready(index, ['python-wheel']) == ['python-setuptools']
+    assert newly_ready(index, ['python-setuptools', 'python-wheel']) == ['python-pip']
+
+
+def test_newly_ready_skips_done_components_and_their_variants(index):
+    assert newly_ready(index, ['python-setuptools', 'python-wheel', 'python-pip']) == []
+
+
+Package = collections.namedtuple('Package', 'name source_name')
+
+
+def test_newly_ready_from_evaluated_buildroots():
+    all_components = ReverseLookupDict()
+    for component, name in [('python-setuptools', 'python3-setuptools'), ('python-wheel', 'python3-wheel'),
+                            ('python-pip', 'python3-pip')]:
+        all_components[component].append(Package(name, component))
+    all_components.default_factory = None
+    buildroots = {}
+    for component, requires in [('python-wheel', ['python-setuptools']),
+                                ('python-pip', ['python-setuptools', 'python-wheel'])]:
+        are_all_done(
+            component=component,
+            packages_to_check=[all_components[c][0] for c in requires],
+            all_components=all_components,
+            components_done={},
+            blocker_counter=new_blocker_counter(),
+            loop_detector={},
+            buildroots=buildroots,
+        )
+    index = build_index(buildroots)
+    assert index['buildroots']['python-wheel']['blocking'] == ['python-setuptools']
+    assert newly_ready(index, ['python-setuptools']) == ['python-wheel']
+    assert newly_ready(index, ['python-setuptools', 'python-wheel']) == ['python-pip']
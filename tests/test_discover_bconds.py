@@ -0,0 +1,123 @@
+import collections
+import subprocess
+import sys
+import tomllib
+import types
+
+import pytest
+
+import discover_bconds
+from discover_bconds import blocking_buildrequires, buildrequires_changes, candidate_bconds, declared_bconds, rank_candidates, to_toml
+from utils import Bcond
+
+
+Package = collections.namedtuple('Package', 'name source_name')
+
+# python-rpm-macros is in the cluster, but it is in the default buildroot, so it never blocks anything
+DEFAULT_BUILDROOT = [Package('bash', 'bash'), Package('python-rpm-macros', 'python-rpm-macros')]
+INSTALLS = {
+    'python3-devel': [Package('python3-devel', 'python3.12'), Package('python-rpm-macros', 'python-rpm-macros')],
+    'python3-pluggy': [Package('python3-pluggy', 'python-pluggy')],
+    'python3-pytest': [Package('python3-pytest', 'pytest'), Package('python3-pluggy', 'python-pluggy')],
+    'python3-hypothesis': [Package('python3-hypothesis', 'python-hypothesis'), Package('python3-pytest', 'pytest'),
+                           Package('python3-pluggy', 'python-pluggy')],
+    'python3-sphinx': [Package('python3-sphinx', 'python-sphinx')],
+}
+CLUSTER = {'pytest', 'python-pluggy', 'python-hypothesis', 'python-rpm-macros'}
+
+
+def resolve_requires(requires):
+    if unknown := set(requires) - set(INSTALLS):
+        raise ValueError(f'Cannot resolve {unknown}')
+    return DEFAULT_BUILDROOT + [p for r in requires for p in INSTALLS[r]]
+
+
+@pytest.fixture
+def stubbed_resolver(monkeypatch):
+    resolver = types.ModuleType('resolve_buildroot')
+    resolver.resolve_requires = resolve_requires
+    monkeypatch.setitem(sys.modules, 'resolve_buildroot', resolver)
+
+
+def test_declared_bconds():
+    spec_text = '\n'.join([
+        '%bcond_without tests',
+        '%bcond_with bootstrap',
+        '%bcond docs 1',
+        '  %bcond_without tests',
+        '%if %{with bootstrap}',
+        '%global _without_tests 1',
+        '%endif',
+    ])
+    assert declared_bconds(spec_text) == ('bootstrap', 'docs', 'tests')
+
+
+def test_candidate_bconds():
+    assert [b.id for b in candidate_bconds('python-foo', ('bootstrap',))] == [
+        'python-foo::bootstrap:::',
+        'python-foo:bootstrap::::',
+    ]
+
+
+def test_to_toml():
+    assert to_toml(2, Bcond('python-foo', withs=['bootstrap'], withouts=['tests', 'docs']),
+                   ('python3-sphinx', 'python3-pytest')) == '\n'.join([
+        '# drops 2 blocking BuildRequires: python3-sphinx, python3-pytest',
+        '[[bconds.python-foo]]',
+        'withs = ["bootstrap"]',
+        'withouts = ["docs", "tests"]',
+    ])
+
+
+@pytest.mark.parametrize('component', ['python-foo', 'python3.12', 'libsigc++20'])
+def test_to_toml_key(component):
+    snippet = to_toml(1, Bcond(component, withouts=['tests']), ('python3-pytest',))
+    assert tomllib.loads(snippet) == {'bconds': {component: [{'withouts': ['tests']}]}}
+
+
+def test_buildrequires_changes_skips_broken_components(monkeypatch, tmp_path):
+    def clone_or_refresh(component_name, repopath):
+        raise subprocess.CalledProcessError(1, ['fedpkg', 'clone', component_name], stderr='no such repo')
+
+    monkeypatch.setitem(discover_bconds.CONFIG['cache_dir'], 'fedpkg', str(tmp_path))
+    monkeypatch.setattr(discover_bconds, 'clone_or_refresh', clone_or_refresh)
+    assert buildrequires_changes('python-foo') == []
+
+
+def test_blocking_buildrequires(stubbed_resolver):
+    buildrequires = ('nonexistent', 'python3-devel', 'python3-pluggy', 'python3-pytest', 'python3-sphinx')
+    assert blocking_buildrequires(buildrequires, 'python-pluggy', CLUSTER) == ('python3-pytest',)
+    assert blocking_buildrequires(buildrequires, 'pytest', CLUSTER) == ('python3-pluggy', 'python3-pytest')
+
+
+def test_rank_candidates(stubbed_resolver):
+    changes_by_component = {
+        'python-pluggy': [
+            (Bcond('python-pluggy', withouts=['tests']), ('python3-hypothesis', 'python3-pytest'), ()),
+            (Bcond('python-pluggy', withouts=['docs']), ('python3-sphinx',), ()),
+            (Bcond('python-pluggy', withs=['bootstrap']), ('python3-pytest',), ('python3-hypothesis',)),
+        ],
+        'pytest': [
+            (Bcond('pytest', withouts=['tests']), ('python3-hypothesis',), ()),
+            (Bcond('pytest', withs=['bootstrap']), ('python3-devel', 'python3-pluggy'), ('python3-sphinx',)),
+        ],
+    }
+    assert [(score, bcond.id, dropped) for score, bcond, dropped in rank_candidates(changes_by_component, CLUSTER)] == [
+        (2, 'pytest:tests:bootstrap:::', ('python3-hypothesis', 'python3-pluggy')),
+        (2, 'python-pluggy:tests::::', ('python3-hypothesis', 'python3-pytest')),
+        (1, 'pytest::bootstrap:::', ('python3-pluggy',)),
+        (1, 'pytest:tests::::', ('python3-hypothesis',)),
+    ]
+
+
+def test_rank_candidates_does_not_combine_conflicting_bconds(stubbed_resolver):
+    changes_by_component = {
+        'pytest': [
+            (Bcond('pytest', withs=['bootstrap']), ('python3-pluggy',), ()),
+            (Bcond('pytest', withouts=['bootstrap']), ('python3-hypothesis',), ()),
+        ],
+    }
+    assert [bcond.id for _, bcond, _ in rank_candidates(changes_by_component, CLUSTER)] == [
+        'pytest::bootstrap:::',
+        'pytest:bootstrap::::',
+    ]
@@ -0,0 +1,137 @@
+import hashlib
+import http.server
+import threading
+
+import pytest
+
+from fetch import FetchJob, fetch, fetch_all
+
+
+CONTENT = bytes(range(256)) * 4096  # 1 MiB
+SHA256 = hashlib.sha256(CONTENT).hexdigest()
+
+
+class KojiStandIn(http.server.BaseHTTPRequestHandler):
+    """
+    Serves CONTENT on any path, with support for ranges.
+    The server attributes control misbehavior: ranges can be ignored, served from the wrong offset
+    and the first responses can be cut short.
+    """
+    def do_GET(self):
+        self.server.requests.append(self.headers.get('Range'))
+        start = 0
+        if (range_ := self.headers.get('Range')) and self.server.ranges:
+            start = 0 if self.server.bad_ranges else int(range_.removeprefix('bytes=').removesuffix('-'))
+            if start >= len(CONTENT):
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(CONTENT)-1}/{len(CONTENT)}')
+        else:
+            self.send_response(200)
+        body = CONTENT[start:]
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        with self.server.lock:
+            if interrupt := self.server.interruptions > 0:
+                self.server.interruptions -= 1
+        if interrupt:
+            body = body[:len(body) // 2]
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), KojiStandIn)
+    server.requests = []
+    server.ranges = True
+    server.bad_ranges = False
+    server.interruptions = 0
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def url(server, filename='foo-1.0-1.src.rpm'):
+    return f'http://127.0.0.1:{server.server_port}/work/tasks/1234/1234/{filename}'
+
+
+def test_fetch_verifies_and_renames(server, tmp_path):
+    destination = tmp_path / 'foo-1.0-1.src.rpm'
+    assert fetch(FetchJob(url(server), destination, size=len(CONTENT), sha256=SHA256)) == destination
+    assert destination.read_bytes() == CONTENT
+    assert list(tmp_path.iterdir()) == [destination]
+
+
+def test_fetch_resumes_interrupted_download(server, tmp_path):
+    server.interruptions = 1
+    destination = tmp_path / 'foo-1.0-1.src.rpm'
+    fetch(FetchJob(url(server), destination, sha256=SHA256))
+    assert destination.read_bytes() == CONTENT
+    assert server.requests == [None, f'bytes={len(CONTENT) // 2}-']
+
+
+def test_fetch_resumes_partial_file(server, tmp_path):
+    destination = tmp_path / 'foo-1.0-1.src.rpm'
+    (tmp_path / 'foo-1.0-1.src.rpm.part').write_bytes(CONTENT[:1000])
+    fetch(FetchJob(url(server), destination, sha256=SHA256))
+    assert destination.read_bytes() == CONTENT
+    assert server.requests == ['bytes=1000-']
+
+
+def test_fetch_complete_partial_file(server, tmp_path):
+    destination = tmp_path / 'foo-1.0-1.src.rpm'
+    (tmp_path / 'foo-1.0-1.src.rpm.part').write_bytes(CONTENT)
+    fetch(FetchJob(url(server), destination, sha256=SHA256))
+    assert destination.read_bytes() == CONTENT
+
+
+def test_fetch_starts_over_without_ranges(server, tmp_path):
+    server.ranges = False
+    destination = tmp_path / 'foo-1.0-1.src.rpm'
+    (tmp_path / 'foo-1.0-1.src.rpm.part').write_bytes(b'garbage')
+    fetch(FetchJob(url(server), destination, sha256=SHA256))
+    assert destination.read_bytes() == CONTENT
+
+
+def test_fetch_starts_over_with_wrong_range(server, tmp_path):
+    server.bad_ranges = True
+    destination = tmp_path / 'foo-1.0-1.src.rpm'
+    (tmp_path / 'foo-1.0-1.src.rpm.part').write_bytes(CONTENT[:1000])
+    # no checksum, the download itself must not mix the ranges
+    fetch(FetchJob(url(server), destination))
+    assert destination.read_bytes() == CONTENT
+    assert server.requests == ['bytes=1000-', None]
+
+
+def test_fetch_bad_checksum(server, tmp_path):
+    destination = tmp_path / 'foo-1.0-1.src.rpm'
+    with pytest.raises(RuntimeError):
+        fetch(FetchJob(url(server), destination, sha256='0' * 64), retries=2)
+    assert list(tmp_path.iterdir()) == []
+    assert len(server.requests) == 2
+
+
+def test_fetch_custom_verify(server, tmp_path):
+    def verify(path):
+        raise ValueError('nope')
+
+    with pytest.raises(RuntimeError):
+        fetch(FetchJob(url(server), tmp_path / 'foo-1.0-1.src.rpm'), retries=1, verify=verify)
+
+
+def test_fetch_all(server, tmp_path):
+    server.interruptions = 3
+    jobs = [FetchJob(url(server, f'foo{i}-1.0-1.src.rpm'), tmp_path / f'foo{i}-1.0-1.src.rpm', size=len(CONTENT))
+            for i in range(10)]
+    jobs.append(FetchJob(url(server, 'bad-1.0-1.src.rpm'), tmp_path / 'bad-1.0-1.src.rpm', size=1))
+    # all the interruptions may hit the same job, the bad one fails in any case
+    results = fetch_all(jobs, workers=4, retries=4)
+    assert results == {job: job.destination for job in jobs[:-1]}
+    assert all(job.destination.read_bytes() == CONTENT for job in jobs[:-1])
@@ -1,18 +1,18 @@
-import fcntl
-import pathlib
-import subprocess
-
 import pytest
 
+import resolve_buildroot
 from resolve_buildroot import buildrequires_of
 from resolve_buildroot import resolve_buildrequires_of
 from resolve_buildroot import mandatory_packages_in_groups
-from sacks import ARCH
-from utils import name_or_str
-
+from resolve_buildroot import may_reach
+from resolve_buildroot import packages_reaching
+from resolve_buildroot import resolve_requires
+from resolve_buildroot import resolve_requires_from
+from bconds import extract_buildrequires_if_possible
+from sacks import rawhide_sack
+from utils import bconds_by_id, name_or_str
 
-TESTS_DIR = pathlib.Path(__file__).parent
-RAWHIDE_MOCK = f'fedora-rawhide-{ARCH}'
+from capture_fixtures import GOLDEN_PACKAGES, expected_buildroot
 
 
 def test_mandatory_packages_in_groups_contains_bacis_packages():
@@ -45,31 +45,78 @@ def test_buildrequires_simple(package_name, expected):
     assert buildrequires_of(package_name) == expected
 
 
-# XXX the mock tests are sloooooow
-# XXX sometimes, we might manually need to scrub our cache as well as mock's (--scrub=dnf-cache)
-def run_mock(*cmd, **kwargs):
-    kwargs.setdefault('check', True)
-    kwargs.setdefault('capture_output', True)
-    kwargs.setdefault('text', True)
-    return subprocess.run(['mock', '-r', RAWHIDE_MOCK, '--no-bootstrap-chroot',
-                           '--isolation=simple', *cmd], **kwargs)
+# without the captured golden set (see capture_fixtures.py), this runs mock against live rawhide
+@pytest.mark.parametrize('package_name', GOLDEN_PACKAGES)
+def test_resolve_buildrequires_of(package_name):
+    expected = expected_buildroot(package_name)
+    got = resolve_buildrequires_of(package_name)
+    assert {name_or_str(p) for p in got} == expected
 
 
-def resolve_buildroot_in_mock(package_name):
-    with open((TESTS_DIR / RAWHIDE_MOCK).with_suffix('.lock'), 'w') as lock:
-        fcntl.flock(lock, fcntl.LOCK_EX)
-        run_mock('--init')
-        run_mock('--update')
-        run_mock('--dnf-cmd', 'builddep', package_name)
-        packages = run_mock('--shell', 'rpm -qa --qf=%{NAME}\\\\n').stdout
-    return set(packages.splitlines()) - {'gpg-pubkey'}  # pubkey only installed in mock
+def binary_packages(name):
+    return frozenset(rawhide_sack().query().filter(name=name, arch__neq='src'))
 
 
-@pytest.mark.parametrize('package_name', ['pytest',
-                                          'python-setuptools',
-                                          'python-pip',
-                                          'rpm'])
-def test_resolve_buildrequires_of(package_name):
-    expected = resolve_buildroot_in_mock(package_name)
-    got = resolve_buildrequires_of(package_name)
-    assert {name_or_str(p) for p in got} == expected
+def test_packages_reaching():
+    packages = binary_packages('python3-pytest')
+    reaching = packages_reaching(packages)
+    assert packages <= reaching
+    assert set(rawhide_sack().query().filter(requires=list(packages), arch__neq='src')) <= reaching
+    # cached
+    assert packages_reaching(frozenset(packages)) is reaching
+
+
+def test_may_reach_not():
+    assert not may_reach(buildrequires_of('fedora-repos'), binary_packages('python3-pytest'))
+
+
+# may_reach() may only err on the side of caution
+@pytest.mark.parametrize('package_name', GOLDEN_PACKAGES)
+@pytest.mark.parametrize('probe', ['python3-pytest', 'python3-setuptools', 'python3-pip', 'python3-rpm'])
+def test_may_reach_when_resolved(package_name, probe):
+    packages = binary_packages(probe)
+    if set(resolve_buildrequires_of(package_name)) & packages:
+        assert may_reach(buildrequires_of(package_name), packages)
+
+
+def variants(requires):
+    yield requires
+    yield requires[1:]
+    yield requires[:-1]
+    yield requires[::2]
+    yield requires[1::2]
+    yield requires + ('python3-pytest',)
+
+
+# the delta resolution must give exactly what resolving from scratch does
+@pytest.mark.parametrize('package_name', GOLDEN_PACKAGES)
+def test_resolve_requires_from(package_name):
+    base_requires = buildrequires_of(package_name)
+    for requires in variants(base_requires):
+        requires = tuple(sorted(set(requires)))
+        assert set(resolve_requires_from(base_requires, requires)) == set(resolve_requires(requires))
+
+
+# a variant that only drops requirements is taken from the base buildroot, without running the solver
+@pytest.mark.parametrize('package_name', GOLDEN_PACKAGES)
+def test_resolve_requires_from_does_not_solve_dropped(package_name, monkeypatch):
+    base_requires = buildrequires_of(package_name)
+    base_installs = resolve_requires(base_requires)
+    requires = base_requires[1:]
+    expected = set(resolve_requires(requires))
+
+    def resolve_requires_base_only(requires, ignore_weak_deps=True):
+        assert requires == base_requires, 'the solver was run for the variant'
+        return base_installs
+
+    monkeypatch.setattr(resolve_buildroot, 'resolve_requires', resolve_requires_base_only)
+    assert set(resolve_requires_from.__wrapped__(base_requires, requires)) == expected
+
+
+# with the captured fixtures, those are the bconds from tests/fixtures/config.toml
+@pytest.mark.parametrize('bcond', bconds_by_id().values(), ids=bconds_by_id())
+def test_resolve_requires_from_bcond(bcond):
+    if (bcond_buildrequires := extract_buildrequires_if_possible(bcond)) is None:
+        pytest.skip(f'No BuildRequires of {bcond.id}, run bconds.py')
+    requires = tuple(sorted(bcond_buildrequires))
+    assert set(resolve_requires_from(buildrequires_of(bcond.component), requires)) == set(resolve_requires(requires))
@@ -0,0 +1,164 @@
+import collections
+import os
+import pathlib
+import subprocess
+import sys
+import types
+
+import pytest
+
+from shards import dump_results, in_shard, load_results, merge_results, most_common, parse_shard
+
+
+import jobs
+from jobs import ReverseLookupDict, evaluate_campaign
+from utils import Bcond
+
+
+ROOT_DIR = pathlib.Path(__file__).parent.parent
+
+Package = collections.namedtuple('Package', 'name source_name')
+
+COUNT = 40
+ALTERNATIVES = {'python3-c14', 'python3-c38'}  # not yet rebuilt, but another provider is
+
+
+def component_name(i):
+    return f'c{i:02d}'
+
+
+def package_name(i):
+    return f'python3-{component_name(i)}'
+
+
+def buildrequires_of(component):
+    i = int(component[1:])
+    if i == 37:
+        return ('nonexistent',)
+    if i % 6 == 0:
+        return ('bash',)
+    return tuple(sorted({package_name((i * 7 + 3) % COUNT), package_name((i * 11 + 5) % COUNT)}))
+
+
+def resolve_requires(requires):
+    if 'nonexistent' in requires:
+        raise ValueError(f'Cannot resolve {requires}')
+    return [Package('bash', 'bash')] + [Package(name, name.removeprefix('python3-')) for name in requires]
+
+
+def may_reach(requires, packages):
+    hash(packages)  # the real one is cached on the packages
+    return requires != ('bash',)
+
+
+def resolve_requires_avoiding(requires_batch, avoided_names, *, repo_key):
+    return {requires: resolve_requires(requires) for requires in requires_batch
+            if all(name in ALTERNATIVES or name not in avoided_names for name in requires)}
+
+
+def extract_buildrequires_if_possible(bcond):
+    if bcond.component == component_name(25):
+        return None  # not built yet
+    if 'bootstrap' in bcond.withs:
+        return ()
+    return buildrequires_of(bcond.component)[:1]
+
+
+def packages(condition):
+    components = ReverseLookupDict()
+    for i in range(COUNT):
+        if condition(i):
+            components[component_name(i)].append(Package(package_name(i), component_name(i)))
+    components.default_factory = None
+    return components
+
+
+CAMPAIGN = {
+    'deps': {'old': ['python(abi) = 3.11'], 'new': ['python(abi) = 3.12']},
+    'components': {'excluded': [], 'extra': []},
+    'target_repos': 'target',
+    'bconds': {
+        component_name(i): (Bcond(component_name(i), withouts=('tests',)),)
+                           + ((Bcond(component_name(i), withs=('bootstrap',)),) if i % 10 == 0 else ())
+        for i in range(0, COUNT, 5)
+    },
+}
+
+
+def install_stubs(monkeypatch):
+    """
+    Stubs the sacks and the resolver for jobs.evaluate_campaign() on COUNT made-up components.
+    """
+    resolver = types.ModuleType('resolve_buildroot')
+    resolver.buildrequires_of = buildrequires_of
+    resolver.may_reach = may_reach
+    resolver.resolve_requires = resolve_requires
+    resolver.resolve_requires_from = lambda base_requires, requires: resolve_requires(requires)
+    resolver.resolve_requires_avoiding = resolve_requires_avoiding
+    monkeypatch.setitem(sys.modules, 'resolve_buildroot', resolver)
+    monkeypatch.setattr('bconds.extract_buildrequires_if_possible', extract_buildrequires_if_possible)
+    monkeypatch.setattr(jobs, 'packages_to_rebuild', lambda old_deps, **kwargs: packages(lambda i: True))
+    monkeypatch.setattr(jobs, 'packages_built', lambda new_deps, **kwargs: packages(lambda i: i % 4 == 0))
+
+
+@pytest.fixture(autouse=True)
+def stubbed_resolver(monkeypatch):
+    install_stubs(monkeypatch)
+
+
+def evaluate_shard(shard):
+    return dump_results({'default': evaluate_campaign(CAMPAIGN, shard=shard)}, shard)
+
+
+def evaluate_shards_in_processes(count):
+    """
+    Evaluates all shards of the given count, each in a separate process with a different hash seed
+    (as on different hosts), returns their dumps.
+    """
+    env = os.environ | {'PYTHONPATH': os.pathsep.join([str(ROOT_DIR), os.environ.get('PYTHONPATH', '')])}
+    processes = [
+        subprocess.Popen([sys.executable, __file__, f'{index}/{count}'], cwd=ROOT_DIR, text=True,
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                         env=env | {'PYTHONHASHSEED': str(index + 1)})
+        for index in range(count)
+    ]
+    dumps = [process.communicate()[0] for process in processes]
+    assert all(process.returncode == 0 for process in processes)
+    return dumps
+
+
+@pytest.mark.parametrize('count', [1, 2, 3, 7])
+def test_merged_shards_equal_single_process_run(count):
+    dumps = evaluate_shards_in_processes(count)
+    merged = merge_results(load_results(dump) for dump in reversed(dumps))['default']
+    expected = evaluate_campaign(CAMPAIGN)
+    assert expected['pruned'] and expected['ready'] and expected['ready_alternatives']
+    assert merged == expected
+    assert merged['ready'] == expected['ready']
+    assert merged['ready_alternatives'] == expected['ready_alternatives']
+    assert list(merged['loop_detector']) == list(expected['loop_detector'])
+    assert list(merged['buildroots']) == list(expected['buildroots'])
+    for kind, counter in expected['blocker_counter'].items():
+        assert most_common(merged['blocker_counter'][kind], 20) == most_common(counter, 20)
+
+
+def test_every_component_is_in_exactly_one_shard():
+    for component in map(component_name, range(COUNT)):
+        assert sum(in_shard(component, (index, 4)) for index in range(4)) == 1
+
+
+def test_merge_requires_all_shards():
+    with pytest.raises(ValueError):
+        merge_results([load_results(evaluate_shard((0, 2)))])
+
+
+@pytest.mark.parametrize('shard', ['4/4', '-1/4', '1', 'a/b'])
+def test_parse_shard_invalid(shard):
+    with pytest.raises(ValueError):
+        parse_shard(shard)
+
+
+if __name__ == '__main__':
+    # evaluates a single shard, see evaluate_shards_in_processes()
+    install_stubs(pytest.MonkeyPatch())
+    print(evaluate_shard(parse_shard(sys.argv[1])))
@@ -0,0 +1,61 @@
+import dataclasses
+import pickle
+
+import pytest
+
+from utils import Bcond, _bconds_by_id, bconds_by_id
+
+
+def test_bcond_id():
+    bcond = Bcond('complex', withs=['bootstrap'], withouts=['tests', 'docs'],
+                  replacements={'use_supernatural_forces': '1'}, branch='f35', target='f35-side-1234')
+    assert bcond.id == 'complex:docs-tests:bootstrap:use_supernatural_forces:f35:f35-side-1234'
+
+
+def test_bcond_default_branch_is_empty():
+    assert Bcond('gcc', withouts=['tests'], branch='rawhide').id == 'gcc:tests::::'
+
+
+def test_bcond_is_canonical_and_hashable():
+    assert Bcond('gcc', withouts=['tests', 'docs']) == Bcond('gcc', withouts=('docs', 'tests'))
+    assert len({Bcond('gcc', withouts=['tests', 'docs']), Bcond('gcc', withouts=('docs', 'tests'))}) == 1
+
+
+def test_bcond_is_immutable():
+    bcond = Bcond('gcc', withouts=['tests'])
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        bcond.withs = ('bootstrap',)
+    with pytest.raises((AttributeError, TypeError)):
+        bcond.buildrequires = ()
+
+
+def test_bcond_can_be_sent_to_other_processes():
+    bcond = Bcond('gcc', withouts=['tests'], replacements={'with_docs': '0'})
+    assert pickle.loads(pickle.dumps(bcond)) == bcond
+
+
+def test_bcond_same_with_and_without():
+    with pytest.raises(ValueError):
+        Bcond('gcc', withs=['tests'], withouts=['tests'])
+
+
+def test_bconds_by_id():
+    for identifier, bcond in bconds_by_id().items():
+        assert bcond.id == identifier
+
+
+def campaigns_with(*bconds):
+    return {f'campaign{i}': {'bconds': {bcond.component: (bcond,)}} for i, bcond in enumerate(bconds)}
+
+
+def test_bconds_by_id_keeps_equal_bconds_once():
+    bcond = Bcond('gcc', withouts=['tests'], replacements={'with_docs': '0'})
+    assert _bconds_by_id(campaigns_with(bcond, Bcond('gcc', withouts=['tests'], replacements={'with_docs': '0'}))) == {
+        bcond.id: bcond,
+    }
+
+
+def test_bconds_by_id_conflicting_replacements():
+    with pytest.raises(ValueError):
+        _bconds_by_id(campaigns_with(Bcond('gcc', replacements={'with_docs': '0'}),
+                                     Bcond('gcc', replacements={'with_docs': '1'})))
@@ -1,9 +1,143 @@
+import dataclasses
+import functools
+import os
+import pathlib
 import sys
 import tomllib
 
-with open("config.toml", mode="rb") as fp:
+# another config (e.g. the offline test fixtures) can be selected by the environment variable
+CONFIG_PATH = pathlib.Path(os.environ.get('WHATDOIBUILD_CONFIG', 'config.toml'))
+
+with open(CONFIG_PATH, mode="rb") as fp:
     CONFIG = tomllib.load(fp)
 
+# relative cache directories are relative to the config, not to the current working directory
+for _key, _path in CONFIG['cache_dir'].items():
+    CONFIG['cache_dir'][_key] = str(CONFIG_PATH.parent / _path)
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Bcond:
+    """
+    A bcond configuration of a component, as in the [[bconds.X]] tables in the config:
+     - withs, withouts: sorted tuples of bcond names
+     - replacements: a sorted tuple of (macro, value) pairs
+     - branch, target: the dist-git branch and Koji target (empty means default)
+
+    The records are immutable (and hashable), so they are safe to share between threads and processes.
+    The per-run state (SRPMs, Koji tasks, BuildRequires) is stored elsewhere, see bconds.BcondState.
+
+    The id is an unique more or less human-readable string identifier for caching purposes.
+    The form of the identifier is more or less:
+        component:without_configuration:with_configuration:replacements_configuration:branch:target
+
+    With "defaults" empty. E.g. the gcc package built without tests and docs in rawhide would be:
+        gcc:docs-tests::::
+
+    And a complex package without docs and tests but with bootstrap with replaced macro on f35 branch in f35-side-1234:
+        complex:docs-tests:bootstrap:use_supernatular_forces:f35:f35-side-1234
+
+    If multiple options are present, they are sorted for canonical representation
+    and separated with dashes (not possible in macro names).
+    The values of replaced macros are not stored, we assume it won't be needed.
+    From the above notice, it is obvious the form might change in the future.
+    """
+    component: str
+    withs: tuple = ()
+    withouts: tuple = ()
+    replacements: tuple = ()
+    branch: str = ''
+    target: str = ''
+    id: str = dataclasses.field(init=False, compare=False)
+
+    def __post_init__(self):
+        # canonicalize whatever collections were given, so equal configs are equal records
+        object.__setattr__(self, 'withs', tuple(sorted(self.withs)))
+        object.__setattr__(self, 'withouts', tuple(sorted(self.withouts)))
+        object.__setattr__(self, 'replacements', tuple(sorted(dict(self.replacements).items())))
+        if self.branch == CONFIG['distgit']['branch']:
+            object.__setattr__(self, 'branch', '')
+        if conflicts := set(self.withs) & set(self.withouts):
+            raise ValueError(f'Cannot have the same with and without: {", ".join(sorted(conflicts))}')
+        replacements_id = '-'.join(macro for macro, _ in self.replacements)
+        object.__setattr__(self, 'id', f'{self.component}:{"-".join(self.withouts)}:{"-".join(self.withs)}:'
+                                       f'{replacements_id}:{self.branch}:{self.target}')
+
+    @classmethod
+    def from_config(cls, component, bcond_config):
+        """
+        Creates the record from a [[bconds.component]] table.
+        """
+        return cls(component, **bcond_config)
+
+
+def _parse_bconds(bconds_config):
+    return {
+        component: tuple(Bcond.from_config(component, bcond_config) for bcond_config in bcond_configs)
+        for component, bcond_configs in bconds_config.items()
+    }
+
+
+@functools.cache
+def campaigns():
+    """
+    Returns a dict of campaigns to evaluate:
+     - keys: campaign names
+     - values: dicts with the deps, components, target repos key and bconds of the campaign
+       (bconds are a dict of component names to tuples of Bcond records)
+
+    Campaigns are defined as [campaigns.NAME] tables in the config, each with its own
+    deps (old, new), components (excluded, extra), target_repos (a key in [repos]) and bconds.
+    Only deps are mandatory, by default no components are excluded or added,
+    the target repos are the ones under the "target" key and there are no bconds.
+
+    If no campaigns are defined, a single "default" campaign is returned,
+    using the top-level deps, components and bconds.
+
+    The config is only parsed once, the returned dict is shared, do not modify it.
+    """
+    if 'campaigns' not in CONFIG:
+        return {
+            'default': {
+                'deps': CONFIG['deps'],
+                'components': CONFIG['components'],
+                'target_repos': 'target',
+                'bconds': _parse_bconds(CONFIG['bconds']),
+            },
+        }
+    return {
+        name: {
+            'deps': campaign['deps'],
+            'components': {'excluded': [], 'extra': []} | campaign.get('components', {}),
+            'target_repos': campaign.get('target_repos', 'target'),
+            'bconds': _parse_bconds(campaign.get('bconds', {})),
+        }
+        for name, campaign in CONFIG['campaigns'].items()
+    }
+
+
+def _bconds_by_id(all_campaigns):
+    by_id = {}
+    for campaign in all_campaigns.values():
+        for bconds in campaign['bconds'].values():
+            for bcond in bconds:
+                if by_id.setdefault(bcond.id, bcond) != bcond:
+                    raise ValueError(f'Conflicting bconds with identifier {bcond.id}: '
+                                     f'{by_id[bcond.id]!r} and {bcond!r}')
+    return by_id
+
+
+@functools.cache
+def bconds_by_id():
+    """
+    Returns a dict of identifiers to Bcond records of all campaigns.
+    Equal bconds in multiple campaigns are only kept once.
+    The identifiers do not contain the values of the replacements,
+    so when bconds only differ in them, ValueError is raised (they would share their state).
+    """
+    return _bconds_by_id(campaigns())
+
+
 def log(*args, **kwargs):
     """
     A print replacement that prints to stderr.